@@ -0,0 +1,773 @@
+"""
+Incrementally maintained analytics over historical carbon intensity data.
+
+Everything here is fed one row at a time (oldest first) so it can be built in
+a single pass at ingest and kept current as new hourly rows arrive, making the
+corresponding queries O(1) instead of rescans of the raw history.
+"""
+
+import math
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import date
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from carbon_store import CARBON_COLUMN, HOUR, RENEWABLE_COLUMN, RegionColumns, epoch_to_datetime
+
+DAY = 24 * HOUR
+# 1970-01-01 was a Thursday; shifts hour-of-week so that 0 is Monday 00:00 UTC
+_EPOCH_WEEK_OFFSET_HOURS = 3 * 24
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class RollingWindow:
+    """
+    Mean, variance, min and max over the last ``size`` values.
+
+    Mean/variance use Welford's update with a matching removal step; min/max
+    use monotonic deques. Every push is O(1) amortized. To keep floating-point
+    drift from the add/remove steps bounded, the moments are recomputed from the
+    window contents once per ``size`` pushes.
+    """
+
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError("Window size must be at least 1")
+        self.size = size
+        self._values = deque()
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._mins = deque()  # (position, value), values increasing
+        self._maxs = deque()  # (position, value), values decreasing
+        self._position = 0
+        self._since_resync = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def push(self, value: float):
+        """Add the newest value, evicting the oldest once the window is full."""
+        values = self._values
+        values.append(value)
+        count = len(values)
+        delta = value - self._mean
+        self._mean += delta / count
+        self._m2 += delta * (value - self._mean)
+
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((self._position, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((self._position, value))
+        self._position += 1
+
+        if count > self.size:
+            old = values.popleft()
+            count -= 1
+            delta = old - self._mean
+            self._mean -= delta / count
+            self._m2 -= delta * (old - self._mean)
+            expired = self._position - self.size
+            if self._mins[0][0] < expired:
+                self._mins.popleft()
+            if self._maxs[0][0] < expired:
+                self._maxs.popleft()
+
+        self._since_resync += 1
+        if self._since_resync >= self.size:
+            self._resync()
+
+    def _resync(self):
+        """Recompute the moments exactly from the window contents."""
+        self._since_resync = 0
+        count = len(self._values)
+        self._mean = math.fsum(self._values) / count
+        self._m2 = math.fsum((v - self._mean) ** 2 for v in self._values)
+
+    @property
+    def mean(self) -> float:
+        return self._mean
+
+    @property
+    def total(self) -> float:
+        return self._mean * len(self._values)
+
+    @property
+    def stdev(self) -> float:
+        """Sample standard deviation (0 for fewer than two values)."""
+        count = len(self._values)
+        if count < 2:
+            return 0
+        return math.sqrt(max(self._m2, 0.0) / (count - 1))
+
+    @property
+    def min(self) -> float:
+        return self._mins[0][1]
+
+    @property
+    def max(self) -> float:
+        return self._maxs[0][1]
+
+    @property
+    def latest(self) -> float:
+        return self._values[-1]
+
+    def values(self) -> List[float]:
+        """Window contents, oldest first."""
+        return list(self._values)
+
+
+class ProfileTable:
+    """Running sum and count per key (0..size-1); mean lookups are O(1)."""
+
+    def __init__(self, size: int):
+        self.sums = [0.0] * size
+        self.counts = [0] * size
+
+    def add(self, key: int, value: float):
+        self.sums[key] += value
+        self.counts[key] += 1
+
+    def remove(self, key: int, value: float):
+        self.sums[key] -= value
+        self.counts[key] -= 1
+
+    def reset(self):
+        size = len(self.sums)
+        self.sums = [0.0] * size
+        self.counts = [0] * size
+
+    def mean(self, key: int) -> Optional[float]:
+        count = self.counts[key]
+        return self.sums[key] / count if count else None
+
+    def means(self) -> List[Optional[float]]:
+        return [self.mean(key) for key in range(len(self.sums))]
+
+
+def hour_of_day(ts: int) -> int:
+    return ts // HOUR % 24
+
+
+def hour_of_week(ts: int) -> int:
+    """0 = Monday 00:00 UTC."""
+    return (ts // HOUR + _EPOCH_WEEK_OFFSET_HOURS) % 168
+
+
+class _MonthHourKeys(dict):
+    """day number -> month index * 24; months only change once a day, so cache per day."""
+
+    def __missing__(self, day: int) -> int:
+        key = self[day] = (date.fromordinal(_EPOCH_ORDINAL + day).month - 1) * 24
+        return key
+
+    def __call__(self, ts: int) -> int:
+        """(month - 1) * 24 + hour of day, UTC."""
+        return self[ts // DAY] + ts // HOUR % 24
+
+
+month_hour = _MonthHourKeys()
+
+# Seasonal profiles kept over the full history: name -> (key function, number of keys)
+SEASONAL_PROFILES = {
+    'hour_of_day': (hour_of_day, 24),
+    'hour_of_week': (hour_of_week, 168),
+    'month_hour': (month_hour, 12 * 24),
+}
+
+
+class _MonthStarts(dict):
+    """day number -> epoch of the first of that month (UTC), cached per day."""
+
+    def __missing__(self, day: int) -> int:
+        d = date.fromordinal(_EPOCH_ORDINAL + day)
+        start = self[day] = (d.replace(day=1).toordinal() - _EPOCH_ORDINAL) * DAY
+        return start
+
+    def __call__(self, ts: int) -> int:
+        return self[ts // DAY]
+
+
+# Knuth's MMIX LCG constants, for the KLLSketch compaction coin
+_LCG_MULTIPLIER = 6364136223846793005
+_LCG_INCREMENT = 1442695040888963407
+_LCG_MASK = (1 << 64) - 1
+_FLOAT_BYTES = sys.getsizeof(0.0)
+
+
+class KLLSketch:
+    """
+    KLL streaming quantile sketch (Karnin, Lang, Liberty 2016).
+
+    Keeps a stack of compactors; level h holds items standing for 2**h inputs.
+    A full level is sorted and every other item (random offset) is promoted to
+    the next level, so memory stays around 3k items however many values are
+    added, with rank error roughly 1.7/k. Sketches of the same k merge by
+    concatenating levels, so per-bucket sketches combine into any range and
+    per-region sketches into a cross-region distribution. Compaction coin flips
+    come from a per-sketch 64-bit LCG state (a single int rather than a
+    random.Random, as regions hold over a thousand bucket sketches), so results
+    are reproducible.
+    """
+
+    __slots__ = ('k', 'n', 'compactors', '_coin', '_size', '_max_size')
+
+    def __init__(self, k: int = 200, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.compactors: List[List[float]] = [[]]
+        self._coin = seed & _LCG_MASK
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    def _capacity(self, height: int) -> int:
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self._max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _compress(self):
+        for height, items in enumerate(self.compactors):
+            if len(items) >= self._capacity(height):
+                if height + 1 >= len(self.compactors):
+                    self._grow()
+                items.sort()
+                self._coin = (self._coin * _LCG_MULTIPLIER + _LCG_INCREMENT) & _LCG_MASK
+                self.compactors[height + 1].extend(items[self._coin >> 63::2])
+                self.compactors[height] = []
+                self._size = sum(len(level) for level in self.compactors)
+                # One compaction frees at least one slot
+                return
+
+    def update(self, value: float):
+        self.compactors[0].append(value)
+        self.n += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def update_many(self, values: Sequence[float]):
+        """Add many values at once (compacting as needed)."""
+        self.compactors[0].extend(values)
+        self.n += len(values)
+        self._size += len(values)
+        while self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """Fold ``other`` into this sketch in place; returns self."""
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for height, items in enumerate(other.compactors):
+            self.compactors[height].extend(items)
+        self.n += other.n
+        self._size = sum(len(level) for level in self.compactors)
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def copy(self) -> 'KLLSketch':
+        clone = KLLSketch(self.k)
+        clone.merge(self)
+        return clone
+
+    def __len__(self) -> int:
+        """Items currently held (not the number of values added - that is ``n``)."""
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held: the object, its level lists and the boxed float items."""
+        return (sys.getsizeof(self) + sys.getsizeof(self.compactors)
+                + sum(sys.getsizeof(level) for level in self.compactors) + self._size * _FLOAT_BYTES)
+
+    def _weighted(self) -> List[Tuple[float, int]]:
+        return sorted((value, 1 << height) for height, items in enumerate(self.compactors) for value in items)
+
+    def quantiles(self, fractions: Sequence[float]) -> List[Optional[float]]:
+        """Approximate values at the given quantile fractions (0..1); None when empty."""
+        if not self._size:
+            return [None] * len(fractions)
+        weighted = self._weighted()
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for fraction in fractions:
+            target = fraction * total
+            cumulative = 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+            results.append(value)
+        return results
+
+    def rank(self, value: float) -> Optional[float]:
+        """Approximate fraction (0..1) of added values <= ``value``; None when empty."""
+        if not self._size:
+            return None
+        below = total = 0
+        for height, items in enumerate(self.compactors):
+            weight = 1 << height
+            total += weight * len(items)
+            below += weight * sum(1 for item in items if item <= value)
+        return below / total
+
+
+# Rollup granularities that also keep a KLLSketch of carbon intensity per bucket
+SKETCH_BUCKETS = ('day', 'month')
+
+# Rollup granularities: name -> function mapping a timestamp to its bucket's start
+ROLLUP_BUCKETS = {
+    'hour': lambda ts: ts - ts % HOUR,
+    'day': lambda ts: ts - ts % DAY,
+    'month': _MonthStarts(),
+}
+
+
+class RollupTable:
+    """
+    Pre-aggregated count/mean/min/max of carbon intensity and renewable share per bucket.
+
+    Buckets are stored as parallel arrays in time order (rows must be fed oldest
+    first), so a range query is two bisects and a slice of a few hundred cells.
+    With ``with_sketches`` each bucket also gets a KLLSketch of carbon intensity.
+    """
+
+    def __init__(self, bucket: str, with_sketches: bool = False):
+        if bucket not in ROLLUP_BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r}; expected one of {sorted(ROLLUP_BUCKETS)}")
+        self.bucket = bucket
+        self.bucket_start = ROLLUP_BUCKETS[bucket]
+        self.starts = array('q')
+        self.counts = array('q')
+        self.carbon_sum, self.carbon_min, self.carbon_max = array('d'), array('d'), array('d')
+        self.renewable_sum, self.renewable_min, self.renewable_max = array('d'), array('d'), array('d')
+        self.sketches: Optional[List[KLLSketch]] = [] if with_sketches else None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def nbytes(self) -> int:
+        total = len(self.starts) * 8 * 8
+        if self.sketches is not None:
+            total += sys.getsizeof(self.sketches) + sum(sketch.nbytes for sketch in self.sketches)
+        return total
+
+    def _add_bucket(self, start: int, count: int, carbon: Sequence[float], renewable: Sequence[float]):
+        """Merge a run of rows that fall in bucket ``start`` (always the newest bucket)."""
+        c_sum, c_min, c_max = math.fsum(carbon), min(carbon), max(carbon)
+        r_sum, r_min, r_max = math.fsum(renewable), min(renewable), max(renewable)
+        if self.starts and self.starts[-1] == start:
+            if self.sketches is not None:
+                self.sketches[-1].update_many(carbon)
+            self.counts[-1] += count
+            self.carbon_sum[-1] += c_sum
+            self.carbon_min[-1] = min(self.carbon_min[-1], c_min)
+            self.carbon_max[-1] = max(self.carbon_max[-1], c_max)
+            self.renewable_sum[-1] += r_sum
+            self.renewable_min[-1] = min(self.renewable_min[-1], r_min)
+            self.renewable_max[-1] = max(self.renewable_max[-1], r_max)
+            return
+        if self.sketches is not None:
+            sketch = KLLSketch()
+            sketch.update_many(carbon)
+            self.sketches.append(sketch)
+        self.starts.append(start)
+        self.counts.append(count)
+        self.carbon_sum.append(c_sum)
+        self.carbon_min.append(c_min)
+        self.carbon_max.append(c_max)
+        self.renewable_sum.append(r_sum)
+        self.renewable_min.append(r_min)
+        self.renewable_max.append(r_max)
+
+    def add(self, ts: int, carbon: float, renewable: float):
+        """Feed the next (newer) row."""
+        self._add_bucket(self.bucket_start(ts), 1, (carbon,), (renewable,))
+
+    def extend(self, timestamps: Sequence[int], carbon: Sequence[float], renewable: Sequence[float]):
+        """Feed many rows at once, aggregating each bucket's run in one step."""
+        position = 0
+        for start, run in groupby(map(self.bucket_start, timestamps)):
+            count = sum(1 for _ in run)
+            end = position + count
+            self._add_bucket(start, count, carbon[position:end], renewable[position:end])
+            position = end
+
+    def query(self, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> List[Dict]:
+        """Buckets whose start lies in [start_ts floored to its bucket, end_ts], oldest first."""
+        lo, hi = self.index_range(start_ts, end_ts)
+        return [self.cell(i) for i in range(lo, hi)]
+
+    def index_range(self, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> Tuple[int, int]:
+        """[lo, hi) indices of the buckets query() would return."""
+        lo = 0 if start_ts is None else bisect_left(self.starts, self.bucket_start(start_ts))
+        hi = len(self.starts) if end_ts is None else bisect_right(self.starts, end_ts)
+        return lo, max(lo, hi)
+
+    def cell(self, i: int) -> Dict:
+        return rollup_cell(self.starts[i], self.counts[i], self.carbon_sum[i], self.carbon_min[i],
+                           self.carbon_max[i], self.renewable_sum[i], self.renewable_min[i], self.renewable_max[i])
+
+    def cells(self) -> Iterator[Tuple]:
+        """Raw (start, count, carbon sum/min/max, renewable sum/min/max) tuples, oldest first."""
+        return zip(self.starts, self.counts, self.carbon_sum, self.carbon_min, self.carbon_max,
+                   self.renewable_sum, self.renewable_min, self.renewable_max)
+
+
+def rollup_cell(start: int, count: int, carbon_sum: float, carbon_min: float, carbon_max: float,
+                renewable_sum: float, renewable_min: float, renewable_max: float) -> Dict:
+    """JSON-ready form of one rollup bucket."""
+    return {
+        'timestamp': epoch_to_datetime(start).isoformat(),
+        'count': count,
+        'carbon_mean': carbon_sum / count,
+        'carbon_min': carbon_min,
+        'carbon_max': carbon_max,
+        'renewable_mean': renewable_sum / count,
+        'renewable_min': renewable_min,
+        'renewable_max': renewable_max,
+    }
+
+
+def trend_from_means(recent_avg: float, previous_avg: float) -> str:
+    """Classify the change between two averages as increasing/decreasing/stable (5% band)."""
+    diff_pct = ((recent_avg - previous_avg) / previous_avg) * 100
+
+    if diff_pct > 5:
+        return "increasing"
+    elif diff_pct < -5:
+        return "decreasing"
+    else:
+        return "stable"
+
+
+def window_trend(values_newest_first: Sequence[float]) -> str:
+    """Trend of the most recent 10% of values against the 10% before them."""
+    n = len(values_newest_first)
+    if n < 10:
+        return "insufficient_data"
+    recent_window = max(5, n // 10)
+    recent = values_newest_first[:recent_window]
+    previous = values_newest_first[recent_window:recent_window * 2]
+    return trend_from_means(math.fsum(recent) / len(recent), math.fsum(previous) / len(previous))
+
+
+class RegionAnalytics:
+    """
+    Per-region rolling statistics and seasonal profiles, maintained row by row.
+
+    ``stats_window`` is the default window behind get_carbon_stats; ``windows``
+    adds named windows (in hourly rows) that are answered in O(1) as well.
+    The trend compares the newest 10% of the stats window against the 10%
+    before it, using two extra rolling windows so it is O(1) too.
+
+    Seasonal profiles (SEASONAL_PROFILES) cover every row ever fed; the 'recent'
+    profile is hour-of-day over only the newest ``pattern_window`` rows, which
+    is what predict_carbon_intensity has always used. ``rollups`` holds one
+    RollupTable per ROLLUP_BUCKETS granularity (or just ``rollup_buckets``;
+    SKETCH_BUCKETS are needed for ranged distributions), also over the full
+    history.
+    """
+
+    DEFAULT_STATS_WINDOW = 500
+    DEFAULT_PATTERN_WINDOW = 200
+    DEFAULT_WINDOWS = {'24h': 24, '7d': 168, '30d': 720}
+
+    def __init__(self, stats_window: int = DEFAULT_STATS_WINDOW, windows: Optional[Dict[str, int]] = None,
+                 pattern_window: int = DEFAULT_PATTERN_WINDOW, rollup_buckets: Optional[Sequence[str]] = None):
+        self.stats_window = stats_window
+        self.pattern_window = pattern_window
+        self.named_windows = dict(self.DEFAULT_WINDOWS if windows is None else windows)
+        sizes = {stats_window, pattern_window, *self.named_windows.values()}
+        self.trend_window = max(5, stats_window // 10)
+        sizes.update({self.trend_window, self.trend_window * 2})
+        self._windows = {size: RollingWindow(size) for size in sizes}
+
+        self.profiles = {name: ProfileTable(size) for name, (_, size) in SEASONAL_PROFILES.items()}
+        self._profile_keys = [(key_fn, self.profiles[name]) for name, (key_fn, _) in SEASONAL_PROFILES.items()]
+        self.recent_profile = ProfileTable(24)
+        self._recent = deque()  # (hour of day, value) for the newest pattern_window rows
+        self._recent_since_resync = 0
+
+        self.rollups = {bucket: RollupTable(bucket, with_sketches=bucket in SKETCH_BUCKETS)
+                        for bucket in (ROLLUP_BUCKETS if rollup_buckets is None else rollup_buckets)}
+        # Carbon intensity distribution over the full history
+        self.sketch = KLLSketch()
+
+        self.rows = 0
+        self.last_ts = None
+
+    @property
+    def max_window(self) -> int:
+        return max(self._windows)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held: rollup arrays and sketches plus boxed floats in the rolling windows."""
+        total = sum(rollup.nbytes for rollup in self.rollups.values())
+        total += sum(len(window) for window in self._windows.values()) * 32 + self.sketch.nbytes
+        return total
+
+    def add(self, ts: int, carbon: float, renewable: float = 0.0):
+        """Feed the next (newer) row."""
+        self._add_seasonal(ts, carbon)
+        self._add_rolling(ts, carbon)
+        for rollup in self.rollups.values():
+            rollup.add(ts, carbon, renewable)
+        self.sketch.update(carbon)
+        self.rows += 1
+        self.last_ts = ts
+
+    def _add_seasonal(self, ts: int, carbon: float):
+        for key_fn, table in self._profile_keys:
+            table.add(key_fn(ts), carbon)
+
+    def _add_rolling(self, ts: int, carbon: float):
+        for window in self._windows.values():
+            window.push(carbon)
+
+        hour = ts // HOUR % 24
+        self._recent.append((hour, carbon))
+        self.recent_profile.add(hour, carbon)
+        if len(self._recent) > self.pattern_window:
+            self.recent_profile.remove(*self._recent.popleft())
+        self._recent_since_resync += 1
+        if self._recent_since_resync >= self.pattern_window:
+            # Rebuild from the window so add/remove rounding cannot accumulate
+            self._recent_since_resync = 0
+            self.recent_profile.reset()
+            for key, value in self._recent:
+                self.recent_profile.add(key, value)
+
+    def extend(self, columns: RegionColumns, start: int = 0):
+        """Feed rows ``start..`` of a column store, oldest first."""
+        carbon = columns.columns[CARBON_COLUMN]
+        renewable = _renewable_column(columns)
+        timestamps = columns.timestamps
+        for i in range(start, len(timestamps)):
+            self.add(timestamps[i], carbon[i], renewable[i])
+
+    @classmethod
+    def from_columns(cls, columns: RegionColumns, **kwargs) -> 'RegionAnalytics':
+        """
+        Build analytics for a loaded region in one pass over its history.
+
+        Every row feeds the seasonal profiles and rollups; rolling windows only
+        see the rows that can still be inside them.
+        """
+        analytics = cls(**kwargs)
+        analytics._feed(columns, len(columns) - analytics.max_window)
+        return analytics
+
+    @classmethod
+    def from_column_chunks(cls, chunks: Iterable[RegionColumns], rows: int, **kwargs) -> 'RegionAnalytics':
+        """
+        from_columns over a history delivered as consecutive chunks (oldest first), ``rows`` in total.
+
+        Only one chunk is held at a time, so a region can be summarized straight
+        from a database cursor without materializing its history.
+        """
+        analytics = cls(**kwargs)
+        rolling_from = rows - analytics.max_window
+        for chunk in chunks:
+            analytics._feed(chunk, rolling_from - analytics.rows)
+        return analytics
+
+    def _feed(self, columns: RegionColumns, rolling_from: int):
+        """Bulk-add a column store's rows; rolling windows only see rows from index ``rolling_from`` on."""
+        timestamps = columns.timestamps
+        carbon = columns.columns[CARBON_COLUMN]
+        add_seasonal, add_rolling = self._add_seasonal, self._add_rolling
+        for i in range(len(timestamps)):
+            ts, value = timestamps[i], carbon[i]
+            add_seasonal(ts, value)
+            if i >= rolling_from:
+                add_rolling(ts, value)
+        renewable = _renewable_column(columns)
+        for rollup in self.rollups.values():
+            rollup.extend(timestamps, carbon, renewable)
+        self.sketch.update_many(carbon)
+        self.rows += len(timestamps)
+        if len(timestamps):
+            self.last_ts = timestamps[-1]
+
+    def resolve_window(self, window) -> int:
+        """Translate a window spec (None, a configured name, or a row count) into a row count."""
+        return resolve_window(window, self.named_windows, self.stats_window)
+
+    def has_window(self, size: int) -> bool:
+        return size in self._windows
+
+    @property
+    def latest(self) -> Optional[float]:
+        """Most recent carbon intensity (None before any row is added)."""
+        window = self._windows[self.max_window]
+        return window.latest if len(window) else None
+
+    def window_mean(self, size: int) -> Optional[float]:
+        """Mean of a maintained window (None if not maintained or empty)."""
+        window = self._windows.get(size)
+        if window is None or not len(window):
+            return None
+        return window.mean
+
+    def stats(self, size: int) -> Optional[Dict]:
+        """Statistics over the newest ``size`` rows from a maintained window (None if not maintained)."""
+        window = self._windows.get(size)
+        if window is None or not len(window):
+            return None
+        return {
+            'mean': window.mean,
+            'min': window.min,
+            'max': window.max,
+            'current': window.latest,  # Most recent
+            'std': window.stdev,
+            'trend': self._trend(window),
+            'data_points': len(window)
+        }
+
+    def _trend(self, window: RollingWindow) -> str:
+        if len(window) < 10:
+            return "insufficient_data"
+        if window.size == self.stats_window and len(window) == window.size:
+            recent = self._windows[self.trend_window]
+            both = self._windows[self.trend_window * 2]
+            previous_avg = (both.total - recent.total) / self.trend_window
+            return trend_from_means(recent.mean, previous_avg)
+        return window_trend(window.values()[::-1])
+
+    def history(self, bucket: str, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> List[Dict]:
+        """Rollup cells of one granularity ('hour', 'day', 'month') over a time range."""
+        if bucket not in self.rollups:
+            raise ValueError(f"Unknown bucket {bucket!r}; expected one of {sorted(self.rollups)}")
+        return self.rollups[bucket].query(start_ts, end_ts)
+
+    def distribution(self, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> KLLSketch:
+        """
+        Sketch of carbon intensity over [start_ts, end_ts] (whole days), for quantile queries.
+
+        The full history is answered by the region sketch directly. Ranges merge
+        the monthly sketches of months inside the range and the daily sketches
+        of the days left over at either end, so only a few dozen sketches are
+        touched even for multi-year ranges.
+        """
+        if start_ts is None and end_ts is None:
+            return self.sketch
+        days, months = self.rollups['day'], self.rollups['month']
+        merged = KLLSketch(self.sketch.k)
+        lo, hi = days.index_range(start_ts, end_ts)
+        i = lo
+        while i < hi:
+            month_start = months.bucket_start(days.starts[i])
+            m = bisect_left(months.starts, month_start)
+            next_month = months.bucket_start(month_start + 32 * DAY)
+            # Use the month's sketch when every day of it lies inside the range
+            if days.starts[i] == month_start and (end_ts is None or next_month - 1 <= end_ts) \
+                    and m < len(months) and months.starts[m] == month_start:
+                merged.merge(months.sketches[m])
+                i = bisect_left(days.starts, next_month, i, hi)
+            else:
+                merged.merge(days.sketches[i])
+                i += 1
+        return merged
+
+    def seasonal_mean(self, profile: str, ts: int) -> Optional[float]:
+        """
+        Typical carbon intensity at ``ts`` according to a profile (None if that slot has no data).
+
+        ``profile`` is 'recent' or one of SEASONAL_PROFILES.
+        """
+        if profile == 'recent':
+            return self.recent_profile.mean(hour_of_day(ts))
+        if profile not in SEASONAL_PROFILES:
+            raise ValueError(f"Unknown profile {profile!r}; expected 'recent' or one of {sorted(SEASONAL_PROFILES)}")
+        key_fn, _ = SEASONAL_PROFILES[profile]
+        return self.profiles[profile].mean(key_fn(ts))
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], max_points: int) -> List[int]:
+    """
+    Largest-triangle-three-buckets downsampling: indices of at most ``max_points`` points.
+
+    The first and last points are always kept; every bucket in between keeps
+    the point forming the largest triangle with the previously kept point and
+    the next bucket's average, which preserves peaks and troughs. Returns all
+    indices when there are already few enough points.
+    """
+    n = len(ys)
+    if max_points >= n:
+        return list(range(n))
+    if max_points < 3:
+        raise ValueError("LTTB needs at least 3 output points")
+
+    every = (n - 2) / (max_points - 2)
+    selected = [0]
+    a = 0
+    for i in range(max_points - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - end
+        avg_x = math.fsum(xs[end:next_end]) / span
+        avg_y = math.fsum(ys[end:next_end]) / span
+
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def _renewable_column(columns: RegionColumns) -> Sequence[float]:
+    """Renewable share column, or zeros when it was not loaded (the CSV parser's default)."""
+    renewable = columns.columns.get(RENEWABLE_COLUMN)
+    if renewable is None:
+        renewable = array('d', bytes(8 * len(columns)))
+    return renewable
+
+
+def resolve_window(window, named_windows: Dict[str, int] = RegionAnalytics.DEFAULT_WINDOWS,
+                   default: int = RegionAnalytics.DEFAULT_STATS_WINDOW) -> int:
+    """Translate a window spec (None, a named window, or a row count) into a row count."""
+    if window is None:
+        return default
+    if isinstance(window, str):
+        if window in named_windows:
+            return named_windows[window]
+        window = int(window)
+    if window < 1:
+        raise ValueError("Window must cover at least one row")
+    return window
+
+
+def stats_from_values(values_newest_first: Sequence[float]) -> Optional[Dict]:
+    """Same statistics as RegionAnalytics.stats, computed by scanning (for ad-hoc window sizes)."""
+    n = len(values_newest_first)
+    if not n:
+        return None
+    mean = math.fsum(values_newest_first) / n
+    std = math.sqrt(math.fsum((v - mean) ** 2 for v in values_newest_first) / (n - 1)) if n > 1 else 0
+    return {
+        'mean': mean,
+        'min': min(values_newest_first),
+        'max': max(values_newest_first),
+        'current': values_newest_first[0],  # Most recent
+        'std': std,
+        'trend': window_trend(values_newest_first),
+        'data_points': n
+    }
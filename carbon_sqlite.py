@@ -0,0 +1,205 @@
+"""
+SQLite-backed store for historical carbon intensity data.
+
+An alternative to keeping whole regions in memory: readings are imported once
+from HistoricalData into an on-disk database and range, stats and rollup
+queries are answered by indexed lookups. The database runs in WAL mode, so
+several processes (e.g. multiple app workers) can read it concurrently while
+one of them refreshes a region.
+
+Schema:
+    readings(region, ts, carbon, renewable, wind, solar)
+        PRIMARY KEY (region, ts), WITHOUT ROWID - rows are clustered by
+        (region, ts), so the primary key is a covering index for every range
+        query and no separate table lookup is needed.
+    rollups(region, bucket, start, count, carbon_sum/min/max, renewable_sum/min/max)
+        PRIMARY KEY (region, bucket, start), WITHOUT ROWID - same idea for the
+        pre-aggregated hour/day/month buckets.
+    sources(region, path, size, mtime_ns, rows)
+        Which version of each CSV a region was imported from.
+"""
+
+import logging
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+from carbon_analytics import ROLLUP_BUCKETS, RollupTable, rollup_cell, stats_from_values
+from carbon_store import METRIC_COLUMNS, RegionColumns
+
+logger = logging.getLogger(__name__)
+
+# readings column for each METRIC_COLUMNS entry, in the same order
+_READING_COLUMNS = ('carbon', 'renewable', 'wind', 'solar')
+_SELECT_READINGS = f"SELECT ts, {', '.join(_READING_COLUMNS)} FROM readings"
+# Rows per chunk when streaming a region's whole history (about a year of hours)
+CHUNK_ROWS = 8760
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    region TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    carbon REAL NOT NULL,
+    renewable REAL NOT NULL,
+    wind REAL NOT NULL,
+    solar REAL NOT NULL,
+    PRIMARY KEY (region, ts)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollups (
+    region TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    carbon_sum REAL NOT NULL,
+    carbon_min REAL NOT NULL,
+    carbon_max REAL NOT NULL,
+    renewable_sum REAL NOT NULL,
+    renewable_min REAL NOT NULL,
+    renewable_max REAL NOT NULL,
+    PRIMARY KEY (region, bucket, start)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sources (
+    region TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    rows INTEGER NOT NULL
+);
+"""
+
+
+class CarbonSQLiteStore:
+    """On-disk carbon history with one connection per thread."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection (sqlite3 connections must not be shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def source_signature(self, region: str) -> Optional[tuple]:
+        """(path, size, mtime_ns) of the CSV a region was imported from, or None if never imported."""
+        row = self._connection().execute(
+            "SELECT path, size, mtime_ns FROM sources WHERE region = ?", (region,)).fetchone()
+        return tuple(row) if row else None
+
+    def import_columns(self, region: str, columns: RegionColumns, signature: tuple):
+        """
+        Replace a region's readings and rollups with ``columns`` in one transaction.
+
+        ``signature`` is the (path, size, mtime_ns) of the source CSV, recorded so
+        callers can tell when the import is stale.
+        """
+        metrics = [columns.columns[name] for name in METRIC_COLUMNS]
+        rollups = {bucket: RollupTable(bucket) for bucket in ROLLUP_BUCKETS}
+        for rollup in rollups.values():
+            rollup.extend(columns.timestamps, metrics[0], metrics[1])
+
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM readings WHERE region = ?", (region,))
+            conn.execute("DELETE FROM rollups WHERE region = ?", (region,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO readings (region, ts, carbon, renewable, wind, solar) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((region, ts, *values) for ts, *values in zip(columns.timestamps, *metrics)))
+            for bucket, rollup in rollups.items():
+                conn.executemany(
+                    "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((region, bucket, *cell) for cell in rollup.cells()))
+            conn.execute("INSERT OR REPLACE INTO sources (region, path, size, mtime_ns, rows) VALUES (?, ?, ?, ?, ?)",
+                         (region, signature[0], signature[1], signature[2], len(columns)))
+        logger.info(f"Imported {len(columns)} rows for {region} into {self.db_path}")
+
+    @staticmethod
+    def _range_clause(start_ts: Optional[int], end_ts: Optional[int], column: str = 'ts'):
+        clause, params = "", []
+        if start_ts is not None:
+            clause += f" AND {column} >= ?"
+            params.append(start_ts)
+        if end_ts is not None:
+            clause += f" AND {column} <= ?"
+            params.append(end_ts)
+        return clause, params
+
+    def iter_range(self, region: str, start_ts: Optional[int] = None,
+                   end_ts: Optional[int] = None) -> Iterator[tuple]:
+        """Stream (ts, carbon, renewable, wind, solar) rows with start_ts <= ts <= end_ts, oldest first."""
+        clause, params = self._range_clause(start_ts, end_ts)
+        return self._connection().execute(
+            f"{_SELECT_READINGS} WHERE region = ?{clause} ORDER BY ts", (region, *params))
+
+    def load_range(self, region: str, start_ts: Optional[int] = None,
+                   end_ts: Optional[int] = None) -> RegionColumns:
+        """Rows in [start_ts, end_ts] as a column store (oldest first)."""
+        return self._to_columns(region, self.iter_range(region, start_ts, end_ts))
+
+    def iter_chunks(self, region: str, size: int = CHUNK_ROWS) -> Iterator[RegionColumns]:
+        """A region's whole history as consecutive column stores of up to ``size`` rows, oldest first."""
+        cursor = self.iter_range(region)
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                return
+            yield self._to_columns(region, rows)
+
+    def row_count(self, region: str) -> int:
+        """Rows imported for a region (0 if never imported)."""
+        row = self._connection().execute("SELECT rows FROM sources WHERE region = ?", (region,)).fetchone()
+        return row[0] if row else 0
+
+    def tail(self, region: str, n: int) -> RegionColumns:
+        """The newest ``n`` rows as a column store (oldest first)."""
+        rows = self._connection().execute(
+            f"{_SELECT_READINGS} WHERE region = ? ORDER BY ts DESC LIMIT ?", (region, n)).fetchall()
+        rows.reverse()
+        return self._to_columns(region, rows)
+
+    @staticmethod
+    def _to_columns(region: str, rows) -> RegionColumns:
+        timestamps = array('q')
+        values = [array('d') for _ in METRIC_COLUMNS]
+        for ts, *metrics in rows:
+            timestamps.append(ts)
+            for column, value in zip(values, metrics):
+                column.append(value)
+        return RegionColumns(region, timestamps, dict(zip(METRIC_COLUMNS, values)))
+
+    def carbon_stats(self, region: str, window: int) -> Optional[Dict]:
+        """get_carbon_stats over the newest ``window`` rows, read through the primary key."""
+        values = [row[0] for row in self._connection().execute(
+            "SELECT carbon FROM readings WHERE region = ? ORDER BY ts DESC LIMIT ?", (region, window))]
+        return stats_from_values(values)  # Most recent first
+
+    def history(self, region: str, bucket: str, start_ts: Optional[int] = None,
+                end_ts: Optional[int] = None) -> List[Dict]:
+        """Rollup cells whose start lies in [start_ts floored to its bucket, end_ts], oldest first."""
+        if bucket not in ROLLUP_BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r}; expected one of {sorted(ROLLUP_BUCKETS)}")
+        if start_ts is not None:
+            start_ts = ROLLUP_BUCKETS[bucket](start_ts)
+        clause, params = self._range_clause(start_ts, end_ts, column='start')
+        rows = self._connection().execute(
+            "SELECT start, count, carbon_sum, carbon_min, carbon_max, renewable_sum, renewable_min, renewable_max "
+            f"FROM rollups WHERE region = ? AND bucket = ?{clause} ORDER BY start", (region, bucket, *params))
+        return [rollup_cell(*row) for row in rows]
@@ -0,0 +1,1119 @@
+"""
+Columnar storage for historical carbon intensity data.
+
+Region histories are kept as one typed array per metric plus a shared array of
+UTC epoch-second timestamps, instead of one dict (and one datetime object) per
+CSV row. Everything here uses only the Python standard library; reading
+.csv.zst files additionally needs the optional ``zstandard`` package.
+"""
+
+import csv
+import gc
+import gzip
+import io
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from functools import partial
+from itertools import compress, islice, tee
+from operator import add, itemgetter, le
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # .csv.zst support is optional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Metric columns we keep from the Electricity Maps CSV exports
+CARBON_COLUMN = 'carbon_intensity_avg'
+RENEWABLE_COLUMN = 'power_production_percent_renewable_avg'
+METRIC_COLUMNS = (
+    CARBON_COLUMN,
+    RENEWABLE_COLUMN,
+    'power_production_wind_avg',
+    'power_production_solar_avg',
+)
+
+
+# Region data files, plain or compressed (compressed files are decompressed as a stream)
+DATA_FILE_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+
+
+def region_code_for(file_name: str) -> Optional[str]:
+    """Region code a data file name stands for ('US-CAL-CISO.csv.gz' -> 'US-CAL-CISO'), or None."""
+    for suffix in DATA_FILE_SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return None
+
+
+def is_compressed(path: str) -> bool:
+    """Whether a data file has to be decompressed (and so cannot be seeked by byte offset)."""
+    return path.endswith(('.gz', '.zst'))
+
+
+@contextmanager
+def open_csv_text(path: str) -> Iterator[io.TextIOBase]:
+    """
+    Open a region CSV for reading as text, decompressing .gz/.zst on the fly.
+
+    Decompression is incremental, so memory use does not depend on file size.
+    """
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+            yield f
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"Reading {path} requires the 'zstandard' package")
+        with open(path, 'rb') as raw:
+            with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                yield io.TextIOWrapper(reader, encoding='utf-8', newline='')
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            yield f
+
+
+def datetime_to_epoch(dt: datetime) -> int:
+    """Convert a datetime to UTC epoch seconds (naive values are treated as UTC)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def date_to_epoch(date_str: str) -> int:
+    """Convert a "YYYY-MM-DD" date (midnight UTC) to epoch seconds."""
+    return datetime_to_epoch(datetime.strptime(date_str, "%Y-%m-%d"))
+
+
+def to_epoch(value: Union[None, int, float, str, datetime]) -> Optional[int]:
+    """Normalize a range bound (epoch seconds, datetime, ISO date/time string or None) to epoch seconds."""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, datetime):
+        return datetime_to_epoch(value)
+    return parse_iso_timestamp(value)
+
+
+def epoch_to_datetime(ts: int) -> datetime:
+    """Convert UTC epoch seconds to an aware UTC datetime."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+def _parse_iso_timestamp_slow(value: str) -> int:
+    """General ISO-8601 parsing through datetime.fromisoformat."""
+    return datetime_to_epoch(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_DATE_PART = itemgetter(slice(0, 10))
+_TIME_PART = itemgetter(slice(10, None))
+
+
+class _DayTable(dict):
+    """'YYYY-MM-DD' -> epoch seconds of that midnight, filled on first use."""
+
+    def __missing__(self, key: str) -> int:
+        if len(key) != 10 or key[4] != '-' or key[7] != '-':
+            raise ValueError(f"Invalid isoformat date: {key!r}")
+        if len(self) >= IsoTimestampParser.MAX_CACHED_KEYS:
+            self.clear()
+        day = self[key] = (date.fromisoformat(key).toordinal() - _EPOCH_ORDINAL) * 86400
+        return day
+
+
+class _ClockTable(dict):
+    """'THH:MM:SS[.fff][Z|+HH:MM]' -> seconds to add to the UTC midnight, filled on first use."""
+
+    def __missing__(self, key: str) -> int:
+        if key and key[0] not in 'T ':
+            raise ValueError(f"Invalid isoformat time: {key!r}")
+        parsed = datetime.fromisoformat(('1970-01-01' + key).replace('Z', '+00:00'))
+        if parsed.microsecond:
+            # Sub-second values keep the exact truncation of the general path
+            raise ValueError(f"Sub-second time: {key!r}")
+        if len(self) >= IsoTimestampParser.MAX_CACHED_KEYS:
+            self.clear()
+        seconds = self[key] = datetime_to_epoch(parsed)
+        return seconds
+
+
+class IsoTimestampParser:
+    """
+    Bulk epoch-second parser for the ISO-8601 timestamps of the CSV exports.
+
+    A timestamp is split into its date ('2022-12-31') and time-of-day
+    ('T23:00:00.000Z') parts, and each part is looked up in a table that is
+    filled the first time a value is seen. An hourly file has a few thousand
+    distinct dates and 24 distinct times, so nearly every row costs two slices
+    and two dict hits; parse_many runs that entirely through C-level map().
+    Values the tables cannot represent fall back to datetime.fromisoformat, so
+    results match the general path. Invalid values raise ValueError.
+    """
+
+    MAX_CACHED_KEYS = 100_000
+
+    def __init__(self):
+        self._days = _DayTable()
+        self._clocks = _ClockTable()
+
+    def __call__(self, value: str) -> int:
+        try:
+            return self._days[value[:10]] + self._clocks[value[10:]]
+        except ValueError:
+            return _parse_iso_timestamp_slow(value)
+
+    def parse_many(self, values: Iterable[str]) -> array:
+        """Parse a batch of timestamps into an array('q'), falling back per value if needed."""
+        values = values if isinstance(values, list) else list(values)
+        try:
+            return self.parse_many_strict(values)
+        except ValueError:
+            return array('q', map(self, values))
+
+    def parse_many_strict(self, values: Sequence[str]) -> array:
+        """Table-only batch parse; raises ValueError if any value needs the general path."""
+        return array('q', self.iter_strict(values))
+
+    def iter_strict(self, values: Iterable[str]) -> Iterator[int]:
+        """Lazily map values through the tables only (ValueError if one needs the general path)."""
+        dates, times = tee(values)
+        return map(add,
+                   map(self._days.__getitem__, map(_DATE_PART, dates)),
+                   map(self._clocks.__getitem__, map(_TIME_PART, times)))
+
+
+_default_parser = IsoTimestampParser()
+
+
+def parse_iso_timestamp(value: str) -> int:
+    """Parse an ISO-8601 timestamp such as '2022-12-31T23:00:00.000Z' to epoch seconds."""
+    return _default_parser(value)
+
+
+class RegionColumns:
+    """
+    Column-oriented history for a single region.
+
+    Timestamps are UTC epoch seconds in ascending order (oldest first). Each
+    metric lives in its own array('d') keyed by its CSV column name, so a scan
+    over carbon intensity touches one contiguous buffer of doubles.
+    """
+
+    def __init__(self, region: str, timestamps: Optional[Sequence[int]] = None,
+                 columns: Optional[Dict[str, Sequence[float]]] = None, backing=None):
+        self.region = region
+        self.timestamps = timestamps if timestamps is not None else array('q')
+        if columns is None:
+            columns = {name: array('d') for name in METRIC_COLUMNS}
+        self.columns = columns
+        # Keeps a memory map alive while columns are views into it
+        self._backing = backing
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def column(self, name: str) -> Sequence[float]:
+        """Return the typed array for a metric column."""
+        return self.columns[name]
+
+    @property
+    def carbon(self) -> Sequence[float]:
+        """Carbon intensity column (gCO2eq/kWh)."""
+        return self.columns[CARBON_COLUMN]
+
+    def _buffers(self) -> Iterator[Sequence]:
+        yield self.timestamps
+        yield from self.columns.values()
+
+    def _is_mapped(self, values: Sequence) -> bool:
+        """Whether a buffer is a view into the memory-mapped snapshot (not owned by this process)."""
+        return self._backing is not None and isinstance(values, memoryview)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory owned by the column buffers; snapshot-mapped buffers are in mapped_nbytes."""
+        return sum(len(values) * 8 for values in self._buffers() if not self._is_mapped(values))
+
+    @property
+    def mapped_nbytes(self) -> int:
+        """Bytes of column buffers mapped from a snapshot file, which the OS page cache holds and can drop."""
+        return sum(len(values) * 8 for values in self._buffers() if self._is_mapped(values))
+
+    def datetime_at(self, index: int) -> datetime:
+        """Aware UTC datetime of the row at ``index``."""
+        return epoch_to_datetime(self.timestamps[index])
+
+    def append(self, ts: int, values: Dict[str, float]):
+        """Append one row; ``values`` must provide every column held by this store."""
+        self.timestamps.append(ts)
+        for name, column in self.columns.items():
+            column.append(values[name])
+
+    def extend_rows(self, other: 'RegionColumns'):
+        """
+        Append every row of ``other`` (holding the same columns) in place.
+
+        Buffers that cannot grow - memoryviews over a snapshot map, or arrays
+        with live views exported - are first copied into new arrays, so views
+        handed out earlier keep seeing the rows they were made from.
+        """
+        self.timestamps = _grown(self.timestamps, other.timestamps, 'q')
+        for name, values in self.columns.items():
+            self.columns[name] = _grown(values, other.columns[name], 'd')
+        self._backing = None
+
+    def slice(self, start: int, stop: int) -> 'RegionColumns':
+        """Return rows ``[start, stop)`` as a new RegionColumns."""
+        return RegionColumns(
+            self.region,
+            self.timestamps[start:stop],
+            {name: values[start:stop] for name, values in self.columns.items()},
+            backing=self._backing
+        )
+
+    def view(self, start: int, stop: int) -> 'RegionColumns':
+        """
+        Return rows ``[start, stop)`` as zero-copy memoryviews.
+
+        While a view is alive the underlying arrays cannot be resized, so views
+        are meant for short-lived read access (e.g. one simulation run).
+        """
+        return RegionColumns(
+            self.region,
+            memoryview(self.timestamps)[start:stop],
+            {name: memoryview(values)[start:stop] for name, values in self.columns.items()},
+            backing=self._backing
+        )
+
+    def index_range(self, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> Tuple[int, int]:
+        """Binary-search the ``[lo, hi)`` row range with ``start_ts <= ts <= end_ts`` (None = open end)."""
+        lo = 0 if start_ts is None else bisect_left(self.timestamps, start_ts)
+        hi = len(self) if end_ts is None else bisect_right(self.timestamps, end_ts)
+        return lo, max(lo, hi)
+
+    def nearest_index(self, target_ts: int, hint: Optional[int] = None) -> Optional[int]:
+        """
+        Index of the row closest in time to ``target_ts`` (ties go to the later row).
+
+        ``hint`` is the index returned by a previous call with an earlier or equal
+        target; the search then walks forward from it, so a monotonic sequence
+        of lookups costs O(1) amortized. Invalid hints fall back to bisect.
+        """
+        ts = self.timestamps
+        n = len(ts)
+        if n == 0:
+            return None
+        if hint is not None and 0 <= hint < n and (hint == 0 or ts[hint - 1] < target_ts):
+            pos = hint
+            steps = 0
+            while pos < n and ts[pos] < target_ts:
+                pos += 1
+                steps += 1
+                if steps == 8:
+                    # Large jump ahead: finish with a bisect instead of walking
+                    pos = bisect_left(ts, target_ts, pos, n)
+                    break
+        else:
+            pos = bisect_left(ts, target_ts)
+        if pos == n:
+            return n - 1
+        if pos > 0 and target_ts - ts[pos - 1] < ts[pos] - target_ts:
+            return pos - 1
+        return pos
+
+    def between(self, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> 'RegionColumns':
+        """Zero-copy view of the rows with ``start_ts <= ts <= end_ts``."""
+        return self.view(*self.index_range(start_ts, end_ts))
+
+    def tail(self, n: int) -> 'RegionColumns':
+        """Return the most recent ``n`` rows."""
+        if n >= len(self):
+            return self
+        return self.slice(len(self) - n, len(self))
+
+    def to_rows(self, newest_first: bool = True) -> List[Dict]:
+        """
+        Materialize the legacy dict-of-rows view.
+
+        Kept for backward compatibility with callers of load_region_data; it
+        allocates one dict and one datetime per row, so avoid it on hot paths.
+        """
+        indices = range(len(self) - 1, -1, -1) if newest_first else range(len(self))
+        rows = []
+        for i in indices:
+            row = {'datetime': self.datetime_at(i), 'zone_name': self.region}
+            for name, values in self.columns.items():
+                row[name] = values[i]
+            rows.append(row)
+        return rows
+
+
+def _grown(current: Sequence, extra: Sequence, typecode: str) -> array:
+    """``current`` extended by ``extra`` - in place when possible, otherwise as a copy."""
+    if isinstance(current, array):
+        try:
+            current.extend(extra)
+            return current
+        except BufferError:
+            pass
+    grown = array(typecode)
+    grown.frombytes(memoryview(current).cast('B'))
+    grown.extend(extra)
+    return grown
+
+
+def _metric_indices(header: List[str], columns: Sequence[str]) -> Tuple[int, int, List[Tuple[str, Optional[int]]]]:
+    """Header positions of the timestamp, the carbon column and the requested optional metrics."""
+    index = {name: i for i, name in enumerate(header)}
+    optional = [(name, index.get(name)) for name in METRIC_COLUMNS
+                if name != CARBON_COLUMN and name in columns]
+    return index['datetime'], index[CARBON_COLUMN], optional
+
+
+# Rows converted per batch by the column-at-a-time fast path
+PARSE_CHUNK_ROWS = 65536
+# Maps an empty cell to '0' (and anything else to itself) for map(dict.get, xs, xs)
+_EMPTY_AS_ZERO = {'': '0'}
+
+
+def parse_csv_rows(region: str, header: List[str], rows: Iterable[List[str]],
+                   columns: Sequence[str] = METRIC_COLUMNS) -> RegionColumns:
+    """
+    Parse raw CSV rows into a RegionColumns store.
+
+    Rows with an unparsable timestamp or carbon intensity are skipped; missing
+    or empty optional metrics are stored as 0.0. Only the metrics listed in
+    ``columns`` are parsed (carbon intensity is always kept). The result is
+    sorted by time.
+
+    Rows are converted in chunks, one column at a time through C-level map()
+    calls (see _convert_column), which avoids per-row Python work.
+    """
+    dt_idx, carbon_idx, optional = _metric_indices(header, columns)
+
+    store = RegionColumns(region, columns={CARBON_COLUMN: array('d'), **{name: array('d') for name, _ in optional}})
+    parse_ts = IsoTimestampParser()
+    widest = max([dt_idx, carbon_idx] + [idx for _, idx in optional if idx is not None])
+    rows = iter(rows)
+    with _gc_paused():
+        while True:
+            # Blank lines come through csv.reader as empty lists
+            chunk = list(filter(None, islice(rows, PARSE_CHUNK_ROWS)))
+            if not chunk:
+                break
+            if min(map(len, chunk)) <= widest:
+                # Truncated rows are rare; handle the whole chunk the simple way
+                _parse_chunk_rowwise(store, chunk, parse_ts, dt_idx, carbon_idx, optional)
+            else:
+                _parse_chunk_columnwise(store, chunk, parse_ts, dt_idx, carbon_idx, optional)
+
+    return sort_columns(store)
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Suspend the cyclic garbage collector during bulk ingest.
+
+    Parsing allocates millions of short-lived row lists, which would otherwise
+    trigger repeated full collections; none of them can form reference cycles.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _convert_column(typecode: str, cells: List[str], bulk: Callable[[Iterator[str]], Iterator],
+                    one: Callable[[str], float]) -> Tuple[array, List[int]]:
+    """
+    Convert a column of cells with the C-level ``bulk`` mapper.
+
+    array.extend keeps the items converted before an exception, so its length
+    pinpoints the failing cell. That cell is retried with ``one`` (the lenient
+    per-value converter) and bulk conversion resumes after it. Cells that ``one``
+    also rejects get a 0 placeholder and are reported in the returned index list.
+    """
+    out = array(typecode)
+    bad = []
+    while True:
+        try:
+            out.extend(bulk(islice(cells, len(out), None)))
+            return out, bad
+        except ValueError:
+            i = len(out)
+            try:
+                out.append(one(cells[i]))
+            except ValueError:
+                out.append(0)
+                bad.append(i)
+
+
+def _parse_chunk_columnwise(store: RegionColumns, chunk: List[List[str]], parse_ts: IsoTimestampParser,
+                            dt_idx: int, carbon_idx: int, optional: List[Tuple[str, Optional[int]]]):
+    """Convert a chunk one column at a time, then drop rows any column rejected."""
+    converted = []
+    bad = set()
+
+    stamps = list(map(itemgetter(dt_idx), chunk))
+    values, rejected = _convert_column('q', stamps, parse_ts.iter_strict, parse_ts)
+    converted.append(values)
+    bad.update(rejected)
+
+    cells = list(map(itemgetter(carbon_idx), chunk))
+    values, rejected = _convert_column('d', cells, partial(map, float), float)
+    converted.append(values)
+    bad.update(rejected)
+
+    for _, idx in optional:
+        if idx is None:
+            converted.append(array('d', bytes(8 * len(chunk))))
+            continue
+        cells = list(map(itemgetter(idx), chunk))
+        values, rejected = _convert_column('d', cells, _float_or_zero_many, _float_or_zero)
+        converted.append(values)
+        bad.update(rejected)
+
+    if bad:
+        keep = bytearray(b'\x01') * len(chunk)
+        for i in bad:
+            keep[i] = 0
+        converted = [array(values.typecode, compress(values, keep)) for values in converted]
+
+    targets = [store.timestamps, store.columns[CARBON_COLUMN]] + [store.columns[name] for name, _ in optional]
+    for target, values in zip(targets, converted):
+        target.extend(values)
+
+
+def _float_or_zero(cell: str) -> float:
+    return float(cell or 0)
+
+
+def _float_or_zero_many(cells: Iterator[str]) -> Iterator[float]:
+    cells, lookup = tee(cells)
+    return map(float, map(_EMPTY_AS_ZERO.get, cells, lookup))
+
+
+def _parse_chunk_rowwise(store: RegionColumns, chunk: List[List[str]], parse_ts: IsoTimestampParser,
+                         dt_idx: int, carbon_idx: int, optional: List[Tuple[str, Optional[int]]]):
+    """Convert a chunk row by row, skipping invalid rows."""
+    timestamps = store.timestamps
+    carbon = store.columns[CARBON_COLUMN]
+    optional_columns = [(store.columns[name], idx) for name, idx in optional]
+    required = max(dt_idx, carbon_idx)
+
+    for row in chunk:
+        if len(row) <= required:
+            continue
+        try:
+            ts = parse_ts(row[dt_idx])
+            carbon_value = float(row[carbon_idx])
+            extras = [float(row[idx] or 0) if idx is not None and idx < len(row) else 0.0
+                      for _, idx in optional_columns]
+        except ValueError:
+            # Skip invalid rows
+            continue
+        timestamps.append(ts)
+        carbon.append(carbon_value)
+        for (column, _), value in zip(optional_columns, extras):
+            column.append(value)
+
+
+def iter_csv_rows(path: str, region: str, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+                  columns: Sequence[str] = METRIC_COLUMNS) -> Iterator[Dict]:
+    """
+    Stream rows with ``start_ts <= ts <= end_ts`` from a region CSV.
+
+    Only the requested metric columns are converted, and reading stops at the
+    first row past ``end_ts`` - the exports are written in chronological order.
+    Rows are validated like parse_csv_rows (a bad carbon value skips the row).
+    """
+    with open_csv_text(path) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        dt_idx, carbon_idx, optional = _metric_indices(header, columns)
+        keep_carbon = CARBON_COLUMN in columns
+        required = max(dt_idx, carbon_idx)
+        
+        parse_ts = IsoTimestampParser()
+        for row in reader:
+            if len(row) <= required:
+                continue
+            try:
+                ts = parse_ts(row[dt_idx])
+                if start_ts is not None and ts < start_ts:
+                    continue
+                if end_ts is not None and ts > end_ts:
+                    break
+                carbon_value = float(row[carbon_idx])
+                record = {'datetime': epoch_to_datetime(ts), 'zone_name': region}
+                if keep_carbon:
+                    record[CARBON_COLUMN] = carbon_value
+                for name, idx in optional:
+                    record[name] = float(row[idx] or 0) if idx is not None and idx < len(row) else 0.0
+            except ValueError:
+                # Skip invalid rows
+                continue
+            yield record
+
+
+def iter_columns_rows(store: RegionColumns, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+                      columns: Sequence[str] = METRIC_COLUMNS) -> Iterator[Dict]:
+    """Stream rows with ``start_ts <= ts <= end_ts`` from already-loaded columns."""
+    lo, hi = store.index_range(start_ts, end_ts)
+    selected = [(name, store.columns[name]) for name in columns if name in store.columns]
+    for i in range(lo, hi):
+        record = {'datetime': store.datetime_at(i), 'zone_name': store.region}
+        for name, values in selected:
+            record[name] = values[i]
+        yield record
+
+
+def sort_columns(store: RegionColumns) -> RegionColumns:
+    """Ensure a store is in ascending timestamp order (no-op when already sorted)."""
+    ts = store.timestamps
+    if all(map(le, ts, islice(ts, 1, None))):
+        return store
+    order = sorted(range(len(ts)), key=ts.__getitem__)
+    return RegionColumns(
+        store.region,
+        array('q', (ts[i] for i in order)),
+        {name: array('d', (values[i] for i in order)) for name, values in store.columns.items()}
+    )
+
+
+def read_csv_tail(path: str, n: int, block_size: int = 64 * 1024) -> Tuple[List[str], List[List[str]]]:
+    """
+    Return the header and the last ``n`` non-empty rows of a CSV file.
+
+    Blocks are read backwards from the end of the file until ``n`` complete
+    lines are available, so the cost scales with ``n`` rather than file size.
+    Rows are split on newlines, which holds for the Electricity Maps exports
+    (no quoted fields containing line breaks). Compressed files cannot be read
+    backwards, so they are streamed once keeping only the last ``n`` rows.
+    """
+    if is_compressed(path):
+        with open_csv_text(path) as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader)
+            return header, list(deque(filter(None, reader), maxlen=n)) if n > 0 else []
+    
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8')]))
+        data_start = f.tell()
+        pos = f.seek(0, os.SEEK_END)
+        
+        chunks: List[bytes] = []
+        newlines = 0
+        lines: List[bytes] = []
+        while n > 0 and pos > data_start:
+            read_size = min(block_size, pos - data_start)
+            pos -= read_size
+            f.seek(pos)
+            chunk = f.read(read_size)
+            chunks.append(chunk)
+            newlines += chunk.count(b'\n')
+            # n + 1 newlines guarantee n complete lines; only then pay for a split
+            if newlines <= n and pos > data_start:
+                continue
+            lines = b''.join(reversed(chunks)).split(b'\n')
+            if pos > data_start:
+                # The first piece may be the middle of a line
+                lines = lines[1:]
+            lines = [line for line in lines if line.strip()]
+            if len(lines) >= n:
+                break
+            # Blank lines made us come up short; read on
+            newlines = len(lines)
+    
+    lines = lines[-n:] if n > 0 else []
+    rows = list(csv.reader(line.rstrip(b'\r').decode('utf-8') for line in lines))
+    return header, rows
+
+
+def read_csv_tail_columns(path: str, region: str, n: int,
+                          columns: Sequence[str] = METRIC_COLUMNS) -> RegionColumns:
+    """Read only the last ``n`` rows of a region CSV into columns."""
+    header, rows = read_csv_tail(path, n)
+    return parse_csv_rows(region, header, rows, columns)
+
+
+# Bytes compared at the start of a file and just before the consumed offset to
+# recognise a file that was rewritten rather than appended to
+FINGERPRINT_BYTES = 256
+
+
+def file_fingerprint(path: str, offset: int) -> Tuple[bytes, bytes]:
+    """The first bytes of a file and the bytes just before ``offset``."""
+    with open(path, 'rb') as f:
+        head = f.read(min(offset, FINGERPRINT_BYTES))
+        start = max(0, offset - FINGERPRINT_BYTES)
+        f.seek(start)
+        tail = f.read(offset - start)
+    return head, tail
+
+
+def read_appended_columns(path: str, region: str, offset: int,
+                          columns: Sequence[str] = METRIC_COLUMNS) -> Tuple[RegionColumns, int]:
+    """
+    Parse the complete lines written after byte ``offset`` of a CSV.
+
+    A trailing partial line (a writer still mid-row) is left for next time.
+    Returns the parsed rows and the offset just past the last complete line.
+    """
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8')]))
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    rows = filter(None, csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')))
+    return parse_csv_rows(region, header, rows, columns), offset + end
+
+
+def read_csv_metadata(path: str) -> Optional[Dict[str, object]]:
+    """
+    Read just the header and first data row of a region CSV.
+
+    Returns {'header': [...], 'zone_name': str or None}, or None when the file
+    does not look like a carbon intensity export (no datetime/carbon columns).
+    """
+    with open_csv_text(path) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if not header or 'datetime' not in header or CARBON_COLUMN not in header:
+            return None
+        first = next(filter(None, reader), None)
+    zone_name = None
+    if first is not None and 'zone_name' in header:
+        position = header.index('zone_name')
+        if position < len(first):
+            zone_name = first[position].strip() or None
+    return {'header': header, 'zone_name': zone_name}
+
+
+def read_csv_columns(path: str, region: str, max_rows: Optional[int] = None) -> RegionColumns:
+    """Read a region CSV (plain or compressed) into columns, optionally keeping only the last ``max_rows`` rows."""
+    with open_csv_text(path) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        rows = filter(None, reader)
+        if max_rows is not None:
+            rows = deque(rows, maxlen=max_rows)
+        return parse_csv_rows(region, header, rows)
+
+
+# Files at least this large are split across processes when parallel ingest is enabled
+PARALLEL_INGEST_MIN_BYTES = 64 * 1024 * 1024
+
+
+def process_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """
+    A ProcessPoolExecutor whose workers start from a forkserver (spawn where unavailable).
+
+    Pools are created inside a threaded server (Flask request threads, the file
+    watcher, per-thread SQLite connections); forking such a process directly
+    can leave children holding locks that no thread will ever release.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method), **kwargs)
+
+
+def split_byte_ranges(path: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    Split a CSV's data section (after the header) into ~``parts`` byte ranges.
+
+    Every boundary is moved forward to the start of a line, so each range holds
+    only whole rows and can be parsed independently.
+    """
+    with open(path, 'rb') as f:
+        f.readline()
+        data_start = f.tell()
+        size = f.seek(0, os.SEEK_END)
+        bounds = [data_start]
+        for i in range(1, parts):
+            target = data_start + (size - data_start) * i // parts
+            if target <= bounds[-1]:
+                continue
+            # The line containing byte target-1 ends right before the next line start
+            f.seek(target - 1)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def parse_csv_range(path: str, region: str, header: List[str], start: int, end: int,
+                    columns: Sequence[str] = METRIC_COLUMNS) -> Dict[str, object]:
+    """Process-pool worker: parse bytes [start, end) of a CSV and return a raw-bytes payload."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    rows = filter(None, csv.reader(io.StringIO(text, newline='')))
+    return columns_to_payload(parse_csv_rows(region, header, rows, columns))
+
+
+def read_csv_columns_parallel(path: str, region: str, workers: Optional[int] = None,
+                              columns: Sequence[str] = METRIC_COLUMNS) -> RegionColumns:
+    """
+    Parse one large CSV with several processes.
+
+    The file is cut into newline-aligned byte ranges (split_byte_ranges), each
+    parsed by parse_csv_range in a worker; the typed chunks are concatenated in
+    file order and then put in timestamp order. The result is identical to
+    read_csv_columns.
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(path, 'r', encoding='utf-8', newline='') as csvfile:
+        header = next(csv.reader(csvfile))
+    ranges = split_byte_ranges(path, workers)
+    
+    def merge(payloads):
+        timestamps = array('q')
+        merged = {name: array('d') for name in METRIC_COLUMNS if name == CARBON_COLUMN or name in columns}
+        for payload in payloads:
+            timestamps.frombytes(payload['timestamps'])
+            for name, raw in payload['columns'].items():
+                merged[name].frombytes(raw)
+        return sort_columns(RegionColumns(region, timestamps, merged))
+    
+    workers = min(workers, len(ranges))
+    if workers <= 1:
+        # A pool of one is only overhead
+        return merge(parse_csv_range(path, region, header, start, end, columns) for start, end in ranges)
+    with process_pool(workers) as pool:
+        futures = [pool.submit(parse_csv_range, path, region, header, start, end, columns)
+                   for start, end in ranges]
+        return merge(future.result() for future in futures)
+
+
+# ---------------------------------------------------------------------------
+# Binary snapshots
+# ---------------------------------------------------------------------------
+#
+# A snapshot is a sidecar file next to the CSV ("US-CAL-CISO.csv.gcol") holding
+# the parsed columns in a fixed-width layout:
+#
+#   64-byte header: magic, version, byte order, column count, row count and the
+#                   size/mtime of the source CSV it was built from
+#   int64[rows]     timestamps (epoch seconds, ascending)
+#   float64[rows]   one block per column, in METRIC_COLUMNS order
+#
+# Loading memory-maps the file and exposes each block as a typed memoryview, so
+# startup does no parsing and every process on the host shares the same pages.
+
+SNAPSHOT_SUFFIX = '.gcol'
+SNAPSHOT_MAGIC = b'GCOL'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<4sHBBQqQ')
+_SNAPSHOT_HEADER_SIZE = 64
+_BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
+
+def snapshot_path(csv_path: str) -> str:
+    """Location of the binary snapshot for a CSV file."""
+    return csv_path + SNAPSHOT_SUFFIX
+
+
+def write_snapshot(columns: RegionColumns, path: str, source_size: int, source_mtime_ns: int):
+    """Write columns to a snapshot file atomically (temp file + rename)."""
+    header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, _BYTE_ORDER,
+                                   len(METRIC_COLUMNS), len(columns), source_mtime_ns, source_size)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(_SNAPSHOT_HEADER_SIZE, b'\0'))
+            f.write(array('q', columns.timestamps).tobytes())
+            for name in METRIC_COLUMNS:
+                f.write(array('d', columns.columns[name]).tobytes())
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_snapshot(path: str, region: str, source_size: Optional[int] = None,
+                  source_mtime_ns: Optional[int] = None) -> Optional[RegionColumns]:
+    """
+    Memory-map a snapshot file and return read-only columns backed by it.
+
+    Returns None when the file is missing, malformed, written on a machine with
+    a different byte order, or built from a different version of the source CSV.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _SNAPSHOT_HEADER_SIZE:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    
+    magic, version, byte_order, ncols, nrows, mtime_ns, size = _SNAPSHOT_HEADER.unpack_from(mm, 0)
+    if (magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or byte_order != _BYTE_ORDER
+            or ncols != len(METRIC_COLUMNS)):
+        mm.close()
+        return None
+    if (source_size is not None and size != source_size) or \
+            (source_mtime_ns is not None and mtime_ns != source_mtime_ns):
+        mm.close()
+        return None
+    if len(mm) != _SNAPSHOT_HEADER_SIZE + nrows * 8 * (1 + ncols):
+        mm.close()
+        return None
+    
+    view = memoryview(mm)
+    block = nrows * 8
+    offset = _SNAPSHOT_HEADER_SIZE
+    timestamps = view[offset:offset + block].cast('q')
+    columns = {}
+    for name in METRIC_COLUMNS:
+        offset += block
+        columns[name] = view[offset:offset + block].cast('d')
+    return RegionColumns(region, timestamps, columns, backing=mm)
+
+
+def load_region_file(csv_path: str, region: str, use_snapshot: bool = True,
+                     workers: int = 1) -> Tuple[RegionColumns, str]:
+    """
+    Load a region CSV through its snapshot, rebuilding the snapshot when stale.
+
+    Returns the columns and where they came from ('snapshot' or 'csv'). If the
+    snapshot cannot be written (e.g. read-only data directory) the freshly
+    parsed columns are returned and the CSV will be parsed again next time.
+    With ``workers`` > 1 the CSV is parsed by read_csv_columns_parallel.
+    """
+    def parse() -> RegionColumns:
+        if workers > 1 and not is_compressed(csv_path):
+            return read_csv_columns_parallel(csv_path, region, workers)
+        return read_csv_columns(csv_path, region)
+    
+    if not use_snapshot:
+        return parse(), 'csv'
+    
+    stat = os.stat(csv_path)
+    snap = snapshot_path(csv_path)
+    columns = load_snapshot(snap, region, stat.st_size, stat.st_mtime_ns)
+    if columns is not None:
+        return columns, 'snapshot'
+    
+    columns = parse()
+    try:
+        write_snapshot(columns, snap, stat.st_size, stat.st_mtime_ns)
+    except OSError as e:
+        logger.warning(f"Could not write snapshot {snap}: {e}")
+        return columns, 'csv'
+    
+    # Re-open through the map so this process shares pages with other workers
+    mapped = load_snapshot(snap, region, stat.st_size, stat.st_mtime_ns)
+    return (mapped if mapped is not None else columns), 'csv'
+
+
+def prepare_region_file(csv_path: str, region: str, use_snapshot: bool = True) -> Dict[str, object]:
+    """
+    Process-pool worker: parse (or validate) one region file for a parent process.
+
+    The result is kept small so sending it back does not undo the parallel gain.
+    When the snapshot is current or could be (re)built, only its path is returned
+    and the parent memory-maps it, sharing the same pages. Otherwise the parsed
+    columns come back as raw array bytes (see columns_from_payload).
+    """
+    started = time.perf_counter()
+    columns, source = load_region_file(csv_path, region, use_snapshot=use_snapshot)
+    result = {
+        'region': region,
+        'rows': len(columns),
+        'source': source,
+        'seconds': time.perf_counter() - started,
+        'pid': os.getpid(),
+    }
+    if columns._backing is not None:
+        result['snapshot'] = snapshot_path(csv_path)
+    else:
+        result['payload'] = columns_to_payload(columns)
+    return result
+
+
+def columns_to_payload(columns: RegionColumns) -> Dict[str, object]:
+    """Compact picklable form of a store for sending between processes: raw array bytes."""
+    return {
+        'timestamps': array('q', columns.timestamps).tobytes(),
+        'columns': {name: array('d', values).tobytes() for name, values in columns.columns.items()},
+    }
+
+
+def columns_from_payload(region: str, payload: Dict[str, object]) -> RegionColumns:
+    """Rebuild columns from a columns_to_payload payload."""
+    timestamps = array('q')
+    timestamps.frombytes(payload['timestamps'])
+    columns = {}
+    for name, raw in payload['columns'].items():
+        columns[name] = array('d')
+        columns[name].frombytes(raw)
+    return RegionColumns(region, timestamps, columns)
+
+
+# ---------------------------------------------------------------------------
+# Hourly grid alignment
+# ---------------------------------------------------------------------------
+
+HOUR = 3600
+GAP_FILL_POLICIES = ('ffill', 'linear', 'missing')
+
+
+class HourlyGrid:
+    """
+    Several series resampled onto one shared hourly grid.
+
+    ``values`` is a row-major ``hours x keys`` array('d'): the value of key ``k``
+    at hour ``h`` (time ``start_ts + h * 3600``) is ``values[h * len(keys) + k]``.
+    Cells with no data under the 'missing' gap-fill policy hold NaN.
+    """
+
+    def __init__(self, start_ts: int, hours: int, keys: List[str], values: array):
+        self.start_ts = start_ts
+        self.hours = hours
+        self.keys = keys
+        self.values = values
+
+    def __len__(self) -> int:
+        return self.hours
+
+    @property
+    def end_ts(self) -> int:
+        """Timestamp of the last grid hour."""
+        return self.start_ts + (self.hours - 1) * HOUR
+
+    def timestamp_at(self, hour: int) -> int:
+        return self.start_ts + hour * HOUR
+
+    def hour_index(self, ts: int) -> Optional[int]:
+        """Row for an exact grid timestamp, or None if ``ts`` is off-grid or out of range."""
+        offset = ts - self.start_ts
+        if offset < 0 or offset % HOUR:
+            return None
+        hour = offset // HOUR
+        return hour if hour < self.hours else None
+
+    def row(self, hour: int) -> Dict[str, float]:
+        """Values of every key at one hour, leaving out missing (NaN) cells."""
+        width = len(self.keys)
+        base = hour * width
+        return {key: self.values[base + k] for k, key in enumerate(self.keys)
+                if self.values[base + k] == self.values[base + k]}
+
+    def series(self, key: str) -> array:
+        """All hourly values of one key."""
+        width = len(self.keys)
+        return self.values[self.keys.index(key)::width] if width else array('d')
+
+
+def _resample_hourly(columns: RegionColumns, start: int, hours: int, gap_fill: str,
+                     column: str) -> List[float]:
+    """Bucket one series into hourly means over the grid and fill gaps."""
+    nan = float('nan')
+    ts = columns.timestamps
+    values = columns.columns[column]
+    lo, hi = columns.index_range(start, start + hours * HOUR - 1)
+
+    sums = [0.0] * hours
+    counts = [0] * hours
+    for i in range(lo, hi):
+        hour = (ts[i] - start) // HOUR
+        sums[hour] += values[i]
+        counts[hour] += 1
+    out = [sums[h] / counts[h] if counts[h] else nan for h in range(hours)]
+
+    if gap_fill == 'missing':
+        return out
+
+    observed = [h for h in range(hours) if counts[h]]
+    # Values just outside the grid seed the edges when there are any
+    before = values[lo - 1] if lo > 0 else None
+    after = values[hi] if hi < len(ts) else None
+    if not observed:
+        edge = before if before is not None else after
+        return [edge if edge is not None else nan] * hours
+
+    first, last = observed[0], observed[-1]
+    lead = before if before is not None else out[first]
+    trail = out[last] if gap_fill == 'ffill' or after is None else after
+    for h in range(first):
+        out[h] = lead
+    for h in range(last + 1, hours):
+        out[h] = trail
+
+    for a, b in zip(observed, observed[1:]):
+        if b - a < 2:
+            continue
+        for h in range(a + 1, b):
+            if gap_fill == 'ffill':
+                out[h] = out[a]
+            else:
+                out[h] = out[a] + (out[b] - out[a]) * (h - a) / (b - a)
+    return out
+
+
+def align_hourly(series: Dict[str, RegionColumns], start_ts: Optional[int] = None,
+                 end_ts: Optional[int] = None, gap_fill: str = 'ffill',
+                 column: str = CARBON_COLUMN) -> HourlyGrid:
+    """
+    Resample several series onto one hourly grid covering ``[start_ts, end_ts]``.
+
+    Points are bucketed by the hour they fall in (several points in one hour are
+    averaged). Empty hours are filled according to ``gap_fill``:
+
+    - 'ffill':   carry the last value forward
+    - 'linear':  interpolate between the surrounding values
+    - 'missing': leave NaN in the cell
+
+    With 'ffill' and 'linear' the edges are filled too. Hours before a series'
+    first sample in the range take the last sample before ``start_ts``, or the
+    first in-range value if the series starts inside the range. Hours after its
+    last sample hold the last in-range value ('ffill'), or take the first sample
+    after ``end_ts`` if there is one ('linear'). A series with no samples in the
+    range is filled entirely with its nearest sample outside it, and stays NaN
+    only if it has no samples at all.
+
+    Open range ends default to the earliest/latest timestamp across all series.
+    """
+    if gap_fill not in GAP_FILL_POLICIES:
+        raise ValueError(f"Unknown gap fill policy {gap_fill!r}, expected one of {GAP_FILL_POLICIES}")
+
+    keys = list(series)
+    non_empty = [columns for columns in series.values() if len(columns)]
+    if start_ts is None:
+        start_ts = min((columns.timestamps[0] for columns in non_empty), default=0)
+    if end_ts is None:
+        end_ts = max((columns.timestamps[-1] for columns in non_empty), default=-1)
+
+    start = start_ts - start_ts % HOUR
+    end = end_ts - end_ts % HOUR
+    hours = (end - start) // HOUR + 1 if end >= start else 0
+
+    width = len(keys)
+    values = array('d', [float('nan')]) * (hours * width)
+    for k, key in enumerate(keys):
+        resampled = _resample_hourly(series[key], start, hours, gap_fill, column)
+        values[k::width] = array('d', resampled)
+    return HourlyGrid(start, hours, keys, values)
@@ -1,6 +1,12 @@
 from flask import Flask, render_template_string, request, flash, redirect, url_for, jsonify
 import json
-from simple_data_processor import get_simple_processor, get_simulation_engine
+import logging
+from simple_data_processor import get_simple_processor, get_simulation_engine, CHART_MAX_POINTS
+from carbon_analytics import lttb_indices
+from carbon_store import epoch_to_datetime
+from simulation_sweep import SWEEP_COLUMNS, run_sweep
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = 'change_this_secret_key'
@@ -1000,7 +1006,8 @@ def simple_experiment():
 def get_simple_region_stats(region):
     try:
         processor = get_simple_processor()
-        stats = processor.get_carbon_stats(region)
+        # Optional ?window=24h|7d|30d|<hours>; default is the last 500 readings
+        stats = processor.get_carbon_stats(region, window=request.args.get('window'))
         if stats:
             return jsonify({'success': True, 'stats': stats})
         else:
@@ -1008,17 +1015,75 @@ def get_simple_region_stats(region):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Rolled-up carbon history: /api/history?region=&start=&end=&bucket=hour|day|month"""
+    region = request.args.get('region')
+    if not region:
+        return jsonify({'success': False, 'error': 'region is required'})
+    bucket = request.args.get('bucket', 'day')
+    try:
+        processor = get_simple_processor()
+        history = processor.get_history(region, request.args.get('start'), request.args.get('end'), bucket)
+        if history is None:
+            return jsonify({'success': False, 'error': 'No data available for region'})
+        return jsonify({'success': True, 'region': region, 'bucket': bucket, 'history': history})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/percentiles', methods=['GET'])
+def get_percentiles():
+    """Carbon intensity percentiles: /api/percentiles?region=A[,B...]&p=50,90,99&start=&end="""
+    regions = [r for r in request.args.get('region', '').split(',') if r]
+    if not regions:
+        return jsonify({'success': False, 'error': 'region is required'})
+    try:
+        percentiles = [float(p) for p in request.args.get('p', '50,90,99').split(',') if p]
+        processor = get_simple_processor()
+        result = processor.get_carbon_percentiles(regions, percentiles, request.args.get('start'),
+                                                  request.args.get('end'))
+        if result is None:
+            return jsonify({'success': False, 'error': 'No data available for region'})
+        return jsonify({'success': True, 'regions': regions, 'percentiles': result})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/percentile_rank', methods=['GET'])
+def get_percentile_rank():
+    """Percentile rank of the current (or a given) intensity: /api/percentile_rank?region=&value="""
+    region = request.args.get('region')
+    if not region:
+        return jsonify({'success': False, 'error': 'region is required'})
+    try:
+        value = request.args.get('value')
+        processor = get_simple_processor()
+        result = processor.get_percentile_rank(region, float(value) if value else None)
+        if result is None:
+            return jsonify({'success': False, 'error': 'No data available for region'})
+        return jsonify({'success': True, 'region': region, **result})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """Parsed-region cache hit/miss counters, for checking that CSVs are not re-parsed."""
+    processor = get_simple_processor()
+    return jsonify({'success': True, 'cache': processor.get_cache_stats()})
+
 @app.route('/get_chart_data', methods=['POST'])
 def get_chart_data():
     try:
         data = request.get_json()
         regions = data.get('regions', [])
+        # Optional range (hourly records) and point budget; defaults are the last 24 hours
+        hours = int(data.get('hours', 24))
+        max_points = int(data.get('max_points', CHART_MAX_POINTS))
         
         processor = get_simple_processor()
         chart_data = {}
         
         for region in regions:
-            region_chart_data = processor.generate_simple_chart_data(region)
+            region_chart_data = processor.generate_simple_chart_data(region, hours=hours, max_points=max_points)
             if region_chart_data:
                 chart_data[region] = region_chart_data
         
@@ -1365,6 +1430,120 @@ def run_realtime_experiment():
         return redirect(url_for('simple_experiment'))
 
 
+@app.route('/api/simulate_offline', methods=['POST'])
+def simulate_offline():
+    """
+    Headless fast-forward simulation: replays a whole period without sleeping or
+    HAProxy updates and returns the full results as JSON.
+    
+    Body: {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD", "requests_per_hour": 1000,
+           "include_timeline": true, "sharded": false}
+    
+    "sharded" splits long periods into date shards simulated by worker processes;
+    its timeline has only time, carbon_saved_vs_rr and cumulative_carbon_saved per hour.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        start_date = data.get('start_date', '2022-12-25')
+        end_date = data.get('end_date', '2022-12-31')
+        requests_per_hour = int(data.get('requests_per_hour', 1000))
+        
+        simulation_engine = get_simulation_engine()
+        include_timeline = data.get('include_timeline', True)
+        if data.get('sharded') or not include_timeline:
+            # Batch kernel columns instead of per-hour dicts
+            if data.get('sharded'):
+                results = simulation_engine.run_offline_sharded(start_date, end_date, requests_per_hour)
+            else:
+                results = simulation_engine.run_offline_batch(start_date, end_date, requests_per_hour)
+            if results is None:
+                return jsonify({'success': False, 'error': 'Failed to load simulation data'})
+            kernel = results['kernel']
+            summary = {key: value for key, value in results.items() if key != 'kernel'}
+            summary['backend'] = kernel['backend']
+            if include_timeline:
+                summary['timeline'] = [
+                    {'time': epoch_to_datetime(ts).isoformat(), 'carbon_saved_vs_rr': saved,
+                     'cumulative_carbon_saved': cumulative}
+                    for ts, ok, saved, cumulative in zip(kernel['timestamps'], kernel['simulated'],
+                                                         kernel['carbon_saved'], kernel['cumulative_carbon_saved'])
+                    if ok
+                ]
+            return jsonify({'success': True, 'results': summary})
+        
+        results = simulation_engine.run_offline(start_date, end_date, requests_per_hour)
+        if results is None:
+            return jsonify({'success': False, 'error': 'Failed to load simulation data'})
+        
+        summary = {key: value for key, value in results.items() if key not in ('timeline', 'weight_changes')}
+        summary['timeline'] = [
+            {**hour, 'time': hour['time'].isoformat()} for hour in results['timeline']
+        ]
+        return jsonify({'success': True, 'results': summary})
+    except Exception as e:
+        logger.error(f"Error in offline simulation: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/compare_policies', methods=['POST'])
+def compare_policies():
+    """
+    Compare weighting policies on one period: cumulative carbon savings vs
+    round-robin per policy, side by side.
+    
+    Body: {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD", "requests_per_hour": 1000,
+           "policies": ["inverse_carbon", "threshold", ...]}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        start_date = data.get('start_date', '2022-12-25')
+        end_date = data.get('end_date', '2022-12-31')
+        requests_per_hour = int(data.get('requests_per_hour', 1000))
+        
+        simulation_engine = get_simulation_engine()
+        results = simulation_engine.compare_policies(start_date, end_date, requests_per_hour,
+                                                     data.get('policies'))
+        if results is None:
+            return jsonify({'success': False, 'error': 'Failed to load simulation data'})
+        
+        return jsonify({
+            'success': True,
+            'timestamps': results['timestamps'].tolist(),
+            'elapsed_seconds': results['elapsed_seconds'],
+            'policies': {
+                name: {
+                    'total_carbon_saved': policy_results['total_carbon_saved'],
+                    'cumulative_carbon_saved': policy_results['cumulative_carbon_saved'].tolist()
+                }
+                for name, policy_results in results['policies'].items()
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error in policy comparison: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/run_sweep', methods=['POST'])
+def run_sweep_route():
+    """
+    Parameter sweep over offline simulations, returned as one comparison table.
+    
+    Body: {"periods": [["2022-01-01", "2022-03-31"], ...], "requests_per_hour": [1000, 5000],
+           "weight_ranges": [[50, 256], [1, 256]], "policies": ["inverse_carbon", "threshold"]}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        periods = [tuple(period) for period in data.get('periods', [['2022-12-25', '2022-12-31']])]
+        requests_per_hour = [int(rate) for rate in data.get('requests_per_hour', [1000])]
+        weight_ranges = [(int(low), int(high)) for low, high in data.get('weight_ranges', [[50, 256]])]
+        policies = data.get('policies', ['inverse_carbon'])
+        
+        rows = run_sweep(get_simulation_engine(), periods, requests_per_hour, weight_ranges, policies)
+        if rows is None:
+            return jsonify({'success': False, 'error': 'Failed to load simulation data'})
+        return jsonify({'success': True, 'columns': list(SWEEP_COLUMNS), 'rows': rows})
+    except Exception as e:
+        logger.error(f"Error in parameter sweep: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/simulation_status')
 def simulation_status():
     """
@@ -1547,6 +1726,11 @@ def simulation_status():
                 cumulative_carbon += entry.get('carbon_saved_vs_rr', 0) / 1000  # Convert g to kg
                 cumulative_savings.append(round(cumulative_carbon, 2))
         
+        # Long runs: send Chart.js a bounded, shape-preserving subset of the points
+        keep = lttb_indices(range(len(cumulative_savings)), cumulative_savings, CHART_MAX_POINTS)
+        timeline_labels = [timeline_labels[i] for i in keep]
+        cumulative_savings = [cumulative_savings[i] for i in keep]
+        
         return render_template_string(
             status_template,
             status=status,
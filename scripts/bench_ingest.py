@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Ingest benchmark for historical carbon CSVs.
+
+Generates a synthetic Electricity Maps style CSV (or uses --csv) and reports
+rows/sec for:
+  - legacy:     csv.DictReader + datetime.fromisoformat + one dict per row
+                (the original SimpleCarbonDataProcessor.load_region_data path)
+  - columnar:   carbon_store.read_csv_columns (csv.reader + fast timestamp parser)
+  - parallel:   carbon_store.read_csv_columns_parallel over --workers processes
+  - timestamps: timestamp parsing alone, fromisoformat vs IsoTimestampParser
+  - compressed: read_csv_columns on .csv vs .csv.gz vs .csv.zst (if zstandard
+                is installed): time and tracemalloc peak memory (--compressed)
+
+Usage:
+    python scripts/bench_ingest.py --rows 2000000 --workers 4 --compressed
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from carbon_store import (IsoTimestampParser, _parse_iso_timestamp_slow, read_csv_columns,  # noqa: E402
+                          read_csv_columns_parallel, zstandard)
+
+HEADER = ("datetime,timestamp,zone_name,carbon_intensity_avg,carbon_intensity_production_avg,"
+          "power_production_percent_renewable_avg,power_production_wind_avg,power_production_solar_avg\n")
+
+
+def write_synthetic_csv(path: str, rows: int):
+    """Write an hourly synthetic history with ``rows`` rows."""
+    start = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for i in range(rows):
+            t = start + timedelta(hours=i)
+            ci = 200 + (i * 37) % 250
+            f.write(f"{t.strftime('%Y-%m-%dT%H:%M:%S.000Z')},{int(t.timestamp())},ZZ,"
+                    f"{ci}.25,{ci}.5,{(i * 7) % 100}.5,{(i * 13) % 900}.0,{(i * 5) % 600}.0\n")
+
+
+def legacy_load(path: str) -> int:
+    """The original per-row dict loader, kept here as the baseline."""
+    with open(path, 'r', encoding='utf-8') as csvfile:
+        all_rows = list(csv.DictReader(csvfile))
+    data = []
+    for row in all_rows:
+        try:
+            data.append({
+                'datetime': datetime.fromisoformat(row['datetime'].replace('Z', '+00:00')),
+                'carbon_intensity_avg': float(row['carbon_intensity_avg']),
+                'zone_name': 'ZZ',
+                'power_production_percent_renewable_avg': float(row.get('power_production_percent_renewable_avg', 0) or 0),
+                'power_production_wind_avg': float(row.get('power_production_wind_avg', 0) or 0),
+                'power_production_solar_avg': float(row.get('power_production_solar_avg', 0) or 0)
+            })
+        except (ValueError, KeyError):
+            continue
+    data.sort(key=lambda x: x['datetime'], reverse=True)
+    return len(data)
+
+
+def columnar_load(path: str) -> int:
+    return len(read_csv_columns(path, 'ZZ'))
+
+
+def parallel_load(path: str, workers: int) -> int:
+    return len(read_csv_columns_parallel(path, 'ZZ', workers))
+
+
+def peak_memory(fn, *args) -> int:
+    """Peak Python heap allocation (bytes) while running ``fn``."""
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def write_compressed_copies(path: str, directory: str) -> dict:
+    """Write .csv.gz (and .csv.zst when zstandard is available) copies of ``path``."""
+    copies = {'csv': path}
+    copies['csv.gz'] = os.path.join(directory, 'bench.csv.gz')
+    with open(path, 'rb') as src, gzip.open(copies['csv.gz'], 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst)
+    if zstandard is not None:
+        copies['csv.zst'] = os.path.join(directory, 'bench.csv.zst')
+        with open(path, 'rb') as src, open(copies['csv.zst'], 'wb') as dst:
+            zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+    return copies
+
+
+def timed(label: str, fn, *args, repeat: int = 1) -> float:
+    """Run ``fn`` ``repeat`` times and report the fastest run."""
+    elapsed = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = fn(*args)
+        elapsed = min(elapsed, time.perf_counter() - started)
+    print(f"  {label:<28} {rows:>10,} rows  {elapsed:8.2f}s  {rows / elapsed:>12,.0f} rows/sec")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000, help='rows in the synthetic file')
+    parser.add_argument('--csv', help='benchmark an existing CSV instead of a synthetic one')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per measurement (fastest is reported)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes for the parallel ingest measurement')
+    parser.add_argument('--compressed', action='store_true',
+                        help='also compare ingest of gzip/zstd compressed copies')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.csv
+        if path is None:
+            path = os.path.join(tmp, 'synthetic.csv')
+            print(f"Writing {args.rows:,} synthetic rows...")
+            write_synthetic_csv(path, args.rows)
+        print(f"File: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+        print("Full ingest:")
+        legacy = timed('legacy (DictReader + dicts)', legacy_load, path, repeat=args.repeat)
+        columnar = timed('columnar (read_csv_columns)', columnar_load, path, repeat=args.repeat)
+        print(f"  speedup: {legacy / columnar:.1f}x")
+        if args.workers > 1:
+            parallel = timed(f'parallel ({args.workers} workers)', parallel_load, path, args.workers,
+                             repeat=args.repeat)
+            print(f"  speedup vs columnar: {columnar / parallel:.1f}x")
+
+        with open(path, 'r', encoding='utf-8') as f:
+            next(f)
+            stamps = [line[:line.index(',')] for line in f]
+        print("Timestamp parsing only:")
+        slow = timed('datetime.fromisoformat', lambda: len([_parse_iso_timestamp_slow(s) for s in stamps]),
+                     repeat=args.repeat)
+        fast = timed('IsoTimestampParser', lambda: len(IsoTimestampParser().parse_many(stamps)),
+                     repeat=args.repeat)
+        print(f"  speedup: {slow / fast:.1f}x")
+        
+        if args.compressed:
+            print("Compressed ingest (read_csv_columns):")
+            if zstandard is None:
+                print("  (zstandard not installed - skipping .csv.zst)")
+            for kind, copy in write_compressed_copies(path, tmp).items():
+                label = f'.{kind} ({os.path.getsize(copy) / 1e6:.1f} MB)'
+                timed(label, columnar_load, copy, repeat=args.repeat)
+                print(f"  {'':<28} peak memory {peak_memory(columnar_load, copy) / 1e6:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
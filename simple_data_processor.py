@@ -1,36 +1,159 @@
-import csv
+import json
 import os
 import time
 import threading
 import requests
+from array import array
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Optional
-import statistics
+from typing import Dict, Iterator, List, Tuple, Optional, Sequence
 import logging
 from requests.auth import HTTPBasicAuth
+from carbon_store import (CARBON_COLUMN, METRIC_COLUMNS, RegionColumns, HourlyGrid, align_hourly,
+                          load_region_file, load_snapshot, snapshot_path, read_csv_tail_columns, read_csv_metadata,
+                          prepare_region_file, columns_from_payload, PARALLEL_INGEST_MIN_BYTES,
+                          file_fingerprint, read_appended_columns, region_code_for, is_compressed,
+                          iter_csv_rows, iter_columns_rows, to_epoch, date_to_epoch, datetime_to_epoch, epoch_to_datetime,
+                          process_pool)
+from carbon_analytics import SKETCH_BUCKETS, RegionAnalytics, lttb_indices, resolve_window, stats_from_values, window_trend
+from carbon_sqlite import CarbonSQLiteStore
+from simulation_kernel import (MAX_WEIGHT, MIN_WEIGHT, carbon_weights, hour_result, join_shards,
+                               simulate_grid, simulate_hours, simulate_shard)
+from simulation_policies import compare_policies
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upper bound on points sent to Chart.js per series; longer ranges are downsampled (LTTB)
+CHART_MAX_POINTS = 200
+
+# Regions shipped with the demo; used when nothing is discovered and for display names
+DEFAULT_REGIONS = {
+    "US-CAL-CISO": {"name": "California", "file": "US-CAL-CISO.csv"},
+    "US-NY-NYIS": {"name": "New York", "file": "US-NY-NYIS.csv"},
+    "US-TEX-ERCO": {"name": "Texas", "file": "US-TEX-ERCO.csv"}
+}
+# Optional file in data_dir mapping region code -> {"name": ..., "file": ...}
+REGION_MANIFEST = "regions.json"
+# Default database file for backend='sqlite', created inside data_dir
+SQLITE_FILE = "carbon_history.sqlite3"
+# Smallest shard worth a worker process in run_offline_sharded (about 30 days of hours)
+SHARD_MIN_HOURS = 24 * 30
+# Memory budget for parsed regions, overridable with the GREENBALANCE_CACHE_MB environment variable
+DEFAULT_CACHE_BUDGET_MB = 512
+
 class SimpleCarbonDataProcessor:
     """Simplified CSV processor using only built-in Python libraries."""
     
-    def __init__(self, data_dir: str = "HistoricalData"):
+    def __init__(self, data_dir: str = "HistoricalData", use_snapshots: bool = True,
+                 cache_budget_mb: Optional[float] = None,
+                 parallel_ingest_min_bytes: Optional[int] = PARALLEL_INGEST_MIN_BYTES,
+                 backend: str = 'memory', sqlite_path: Optional[str] = None):
         self.data_dir = data_dir
-        self.available_regions = {
-            "US-CAL-CISO": {"name": "California", "file": "US-CAL-CISO.csv"},
-            "US-NY-NYIS": {"name": "New York", "file": "US-NY-NYIS.csv"},
-            "US-TEX-ERCO": {"name": "Texas", "file": "US-TEX-ERCO.csv"}
-        }
-        self._data_cache = {}
+        # Compile each CSV into a memory-mapped binary sidecar (carbon_store.SNAPSHOT_SUFFIX)
+        self.use_snapshots = use_snapshots
+        # CSVs at least this large are parsed in chunks by several processes (None disables)
+        self.parallel_ingest_min_bytes = parallel_ingest_min_bytes
+        self.ingest_workers = os.cpu_count() or 1
+        # 'memory': regions are held as columns in this process (LRU-bounded).
+        # 'sqlite': CSVs are imported once into an on-disk database that range,
+        # stats and history queries read from, shareable between processes.
+        if backend not in ('memory', 'sqlite'):
+            raise ValueError(f"Unknown backend {backend!r}; expected 'memory' or 'sqlite'")
+        self.backend = backend
+        self.sqlite_store = None
+        if backend == 'sqlite':
+            self.sqlite_store = CarbonSQLiteStore(sqlite_path or os.path.join(data_dir, SQLITE_FILE))
+        # Only headers are read here; region data is loaded on first use
+        self.available_regions = self.discover_regions()
+        
+        if cache_budget_mb is None:
+            cache_budget_mb = float(os.environ.get('GREENBALANCE_CACHE_MB', DEFAULT_CACHE_BUDGET_MB))
+        self.cache_budget_bytes = int(cache_budget_mb * 1024 * 1024)
+        # Parsed regions, least recently used first: region -> (file signature, RegionColumns)
+        self._data_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._region_locks = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+        self._appended_rows = 0
+        # How much of each cached region's file has been ingested: region -> (offset, head bytes, bytes before offset)
+        self._ingest_state = {}
+        self._watcher = None
+        self._watch_stop = threading.Event()
+        # Rolling stats per region: region -> (RegionColumns they were built from, RegionAnalytics)
+        self._analytics = {}
+        # Per-region timing of the last load_regions call: region -> {'seconds', 'source', 'rows'}
+        self.last_load_timings = {}
+    
+    def discover_regions(self) -> Dict[str, Dict[str, str]]:
+        """
+        Find the regions installed in data_dir.
+        
+        Every *.csv (or .csv.gz / .csv.zst) whose header has datetime and carbon
+        intensity columns becomes a region named after the file
+        (US-CAL-CISO.csv.gz -> US-CAL-CISO); a regions.json
+        manifest in the same directory can add regions or override names and files.
+        Only headers and the first row are read. Falls back to DEFAULT_REGIONS when
+        the directory is missing or holds no usable files.
+        """
+        regions = {}
+        try:
+            file_names = sorted(os.listdir(self.data_dir))
+        except OSError:
+            logger.warning(f"Data directory {self.data_dir} not readable; using default regions")
+            return dict(DEFAULT_REGIONS)
+        
+        for file_name in file_names:
+            code = region_code_for(file_name)
+            # Sorted names put X.csv before X.csv.gz and X.csv.zst, so plain files win
+            if code is None or code in regions:
+                continue
+            try:
+                metadata = read_csv_metadata(os.path.join(self.data_dir, file_name))
+            except (OSError, UnicodeDecodeError, ImportError, EOFError) as e:
+                logger.warning(f"Skipping unreadable data file {file_name}: {e}")
+                continue
+            if metadata is None:
+                logger.warning(f"Skipping {file_name}: not a carbon intensity CSV")
+                continue
+            default_name = DEFAULT_REGIONS.get(code, {}).get("name")
+            zone_name = metadata['zone_name'] if metadata['zone_name'] != code else None
+            regions[code] = {"name": default_name or zone_name or code, "file": file_name}
+        
+        manifest_path = os.path.join(self.data_dir, REGION_MANIFEST)
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                for code, info in manifest.items():
+                    if not isinstance(info, dict):
+                        logger.warning(f"Skipping region manifest entry {code!r}: expected an object, got {info!r}")
+                        continue
+                    entry = regions.setdefault(code, {"name": code, "file": f"{code}.csv"})
+                    entry.update({key: info[key] for key in ("name", "file") if key in info})
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error(f"Ignoring invalid region manifest {manifest_path}: {e}")
+        
+        if not regions:
+            logger.warning(f"No region data found in {self.data_dir}; using default regions")
+            return dict(DEFAULT_REGIONS)
+        
+        logger.info(f"Discovered {len(regions)} regions in {self.data_dir}")
+        return regions
+    
+    def refresh_regions(self):
+        """Re-scan data_dir for regions (already cached regions stay cached)."""
+        self.available_regions = self.discover_regions()
     
     def get_available_regions(self) -> Dict[str, str]:
         """Get list of available regions for server assignment."""
         return {code: info["name"] for code, info in self.available_regions.items()}
     
-    def load_region_data(self, region_code: str, max_rows: int | None = None) -> Optional[List[Dict]]:
-        """Load RECENT data for a specific region - reads from END of CSV (2022) not beginning (2020)."""
+    def _region_file(self, region_code: str) -> Optional[str]:
+        """Path of a region's data file, or None (with an error logged) if unavailable."""
         if region_code not in self.available_regions:
             logger.error(f"Region {region_code} not available")
             return None
@@ -40,140 +163,688 @@ class SimpleCarbonDataProcessor:
         if not os.path.exists(file_path):
             logger.error(f"Data file not found: {file_path}")
             return None
+        return file_path
+    
+    def load_region_columns(self, region_code: str, max_rows: int | None = None,
+                            columns: Sequence[str] = METRIC_COLUMNS) -> Optional[RegionColumns]:
+        """
+        Load RECENT data for a region as typed columns (oldest first).
+        
+        The full file is parsed once and cached. With max_rows only the END of the
+        history is returned: sliced from the cache when the region is already
+        loaded, otherwise read by seeking backwards from the end of the CSV and
+        parsing just the metrics named in ``columns``.
+        Returned columns are shared between callers - treat them as read-only.
+        With the sqlite backend the rows are read from the database instead.
+        """
+        file_path = self._region_file(region_code)
+        if file_path is None:
+            return None
+        
+        if self.sqlite_store is not None:
+            if self._sync_sqlite(region_code, file_path) is None:
+                return None
+            if max_rows is not None:
+                return self.sqlite_store.tail(region_code, max_rows)
+            return self.sqlite_store.load_range(region_code)
+        
+        if max_rows is not None:
+            cached = self._peek_cached_columns(region_code, file_path)
+            if cached is not None:
+                return cached.tail(max_rows)
+            try:
+                return read_csv_tail_columns(file_path, region_code, max_rows, columns)
+            except Exception as e:
+                logger.error(f"Error loading recent data for {region_code}: {e}")
+                return None
+        
+        return self._get_cached_columns(region_code, file_path)
+    
+    def iter_region_rows(self, region_code: str, start=None, end=None,
+                         columns: Sequence[str] = METRIC_COLUMNS) -> Iterator[Dict]:
+        """
+        Lazily yield row dicts (oldest first) with start <= datetime <= end.
+        
+        ``start``/``end`` may be datetimes, epoch seconds, ISO strings or None.
+        Rows come from the cached columns or binary snapshot when available;
+        otherwise the CSV is streamed, converting only the requested ``columns``
+        and stopping at the first row past ``end``. Nothing is materialized.
+        """
+        file_path = self._region_file(region_code)
+        if file_path is None:
+            return
+        
+        start_ts, end_ts = to_epoch(start), to_epoch(end)
+        if self.sqlite_store is not None:
+            if self._sync_sqlite(region_code, file_path) is None:
+                return
+            selected = [(i, name) for i, name in enumerate(METRIC_COLUMNS) if name in columns]
+            for ts, *values in self.sqlite_store.iter_range(region_code, start_ts, end_ts):
+                record = {'datetime': epoch_to_datetime(ts), 'zone_name': region_code}
+                for i, name in selected:
+                    record[name] = values[i]
+                yield record
+            return
+        
+        loaded = self._peek_cached_columns(region_code, file_path)
+        if loaded is not None:
+            yield from iter_columns_rows(loaded, start_ts, end_ts, columns)
+        else:
+            yield from iter_csv_rows(file_path, region_code, start_ts, end_ts, columns)
+    
+    def _sync_sqlite(self, region_code: str, file_path: str) -> Optional[Tuple[str, int, int]]:
+        """
+        Make sure the database holds the current version of a region's CSV.
+        
+        Re-imports when the file's size or mtime differ from what was imported.
+        Returns the file signature, or None if the region could not be imported.
+        """
+        signature = self._file_signature(file_path)
+        if signature is None:
+            logger.error(f"Cannot stat data file {file_path}")
+            return None
+        if self.sqlite_store.source_signature(region_code) == signature:
+            return signature
+        
+        with self._region_lock(region_code):
+            if self.sqlite_store.source_signature(region_code) == signature:
+                return signature
+            try:
+                columns, _ = load_region_file(file_path, region_code, use_snapshot=self.use_snapshots,
+                                              workers=self._ingest_workers_for(signature[1]))
+                self.sqlite_store.import_columns(region_code, columns, signature)
+            except Exception as e:
+                logger.error(f"Error importing {region_code} into {self.sqlite_store.db_path}: {e}")
+                return None
+        return signature
+    
+    def _peek_cached_columns(self, region_code: str, file_path: str) -> Optional[RegionColumns]:
+        """
+        Return columns for a region if they can be had without parsing the CSV.
         
+        That is either a current cache entry, or a current binary snapshot (which
+        is cheap to map, so it is added to the cache).
+        """
+        signature = self._file_signature(file_path)
+        cached = self._cache_lookup(region_code, signature)
+        if cached is not None:
+            return cached
+        
+        # A file that only grew is cheap to catch up on
+        if signature is not None and region_code in self._ingest_state:
+            with self._region_lock(region_code):
+                cached = self._cache_lookup(region_code, signature)
+                if cached is None:
+                    cached = self._ingest_appended(region_code, file_path, signature)
+            if cached is not None:
+                return cached
+        
+        if not self.use_snapshots or signature is None:
+            return None
+        mapped = load_snapshot(snapshot_path(file_path), region_code, signature[1], signature[2])
+        if mapped is None:
+            return None
+        with self._cache_lock:
+            self._cache_misses += 1
+        self._cache_store(region_code, signature, mapped)
+        return mapped
+    
+    @staticmethod
+    def _file_signature(file_path: str) -> Optional[Tuple[str, int, int]]:
+        """Cache key for a data file: (path, size, mtime in ns), or None if it cannot be read."""
         try:
-            logger.info(f"Loading RECENT data for {region_code} (from END of CSV - 2022 data)...")
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (file_path, stat.st_size, stat.st_mtime_ns)
+    
+    def _region_lock(self, region_code: str) -> threading.Lock:
+        """Lock serializing loads of one region."""
+        with self._cache_lock:
+            return self._region_locks.setdefault(region_code, threading.Lock())
+    
+    def _get_cached_columns(self, region_code: str, file_path: str) -> Optional[RegionColumns]:
+        """
+        Return parsed columns for a region, re-parsing only when the file's size or mtime changed.
+        
+        When the file only had rows appended since it was loaded, just the new
+        bytes are parsed (see _ingest_appended).
+        """
+        # One parse per region even when several requests miss at the same time
+        with self._region_lock(region_code):
+            signature = self._file_signature(file_path)
+            if signature is None:
+                logger.error(f"Cannot stat data file {file_path}")
+                return None
             
-            # FIXED: Read ALL rows first, then take LAST ones (most recent)
-            all_rows = []
-            with open(file_path, 'r', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                all_rows = list(reader)
+            cached = self._cache_lookup(region_code, signature)
+            if cached is not None:
+                return cached
             
-            # Optionally limit to last N rows for performance
-            if max_rows is not None and len(all_rows) > max_rows:
-                recent_rows = all_rows[-max_rows:]
-            else:
-                recent_rows = all_rows
+            appended = self._ingest_appended(region_code, file_path, signature)
+            if appended is not None:
+                return appended
             
-            data = []
-            for row in recent_rows:
-                try:
-                    # Parse datetime
-                    dt = datetime.fromisoformat(row['datetime'].replace('Z', '+00:00'))
-                    
-                    # Parse carbon intensity
-                    carbon_intensity = float(row['carbon_intensity_avg'])
-                    
-                    # Store cleaned data
-                    data.append({
-                        'datetime': dt,
-                        'carbon_intensity_avg': carbon_intensity,
-                        'zone_name': region_code,
-                        'power_production_percent_renewable_avg': float(row.get('power_production_percent_renewable_avg', 0) or 0),
-                        'power_production_wind_avg': float(row.get('power_production_wind_avg', 0) or 0),
-                        'power_production_solar_avg': float(row.get('power_production_solar_avg', 0) or 0)
-                    })
-                    
-                except (ValueError, KeyError) as e:
-                    # Skip invalid rows
-                    continue
-            
-            # Sort by datetime (most recent first)
-            data.sort(key=lambda x: x['datetime'], reverse=True)
-            
-            # Log the date range we're actually using
-            if data:
-                oldest_date = data[-1]['datetime'].strftime('%Y-%m-%d')
-                newest_date = data[0]['datetime'].strftime('%Y-%m-%d')
-                logger.info(f"Loaded {len(data)} valid records for {region_code} | Date range: {oldest_date} to {newest_date}")
-            else:
-                logger.warning(f"No valid data loaded for {region_code}")
+            with self._cache_lock:
+                self._cache_misses += 1
             
-            return data
+            try:
+                logger.info(f"Loading data for {region_code} from {file_path}...")
+                
+                columns, source = load_region_file(file_path, region_code, use_snapshot=self.use_snapshots,
+                                                   workers=self._ingest_workers_for(signature[1]))
+                
+                # Log the date range we're actually using
+                if len(columns):
+                    oldest_date = columns.datetime_at(0).strftime('%Y-%m-%d')
+                    newest_date = columns.datetime_at(-1).strftime('%Y-%m-%d')
+                    logger.info(f"Loaded {len(columns)} valid records for {region_code} from {source} | Date range: {oldest_date} to {newest_date}")
+                else:
+                    logger.warning(f"No valid data loaded for {region_code}")
+                
+            except Exception as e:
+                logger.error(f"Error loading data for {region_code}: {e}")
+                return None
             
-        except Exception as e:
-            logger.error(f"Error loading data for {region_code}: {e}")
+            self._cache_store(region_code, signature, columns)
+            return columns
+    
+    def load_regions(self, region_codes: Sequence[str],
+                     max_workers: Optional[int] = None) -> Optional[Dict[str, RegionColumns]]:
+        """
+        Load several regions at once, parsing uncached CSVs in parallel processes.
+        
+        CSV parsing is CPU-bound, so threads would serialize on the GIL. Each
+        worker runs carbon_store.prepare_region_file, which builds the region's
+        binary snapshot and returns only its path for this process to memory-map;
+        without snapshots the columns come back as raw array bytes. Regions that
+        are already cached or have a current snapshot are not sent to the pool.
+        Per-region timings are recorded in last_load_timings.
+        Returns None if any region cannot be loaded.
+        """
+        if self.sqlite_store is not None:
+            return self._load_regions_sqlite(region_codes)
+        
+        timings = {}
+        loaded = {}
+        pending = {}
+        for region_code in dict.fromkeys(region_codes):
+            started = time.perf_counter()
+            file_path = self._region_file(region_code)
+            if file_path is None:
+                return None
+            columns = self._peek_cached_columns(region_code, file_path)
+            if columns is not None:
+                loaded[region_code] = columns
+                timings[region_code] = {'seconds': time.perf_counter() - started, 'source': 'cache',
+                                        'rows': len(columns)}
+            else:
+                pending[region_code] = (file_path, self._file_signature(file_path))
+        
+        workers = min(len(pending), max_workers or os.cpu_count() or 1)
+        if workers > 1:
+            started = time.perf_counter()
+            try:
+                with process_pool(workers) as pool:
+                    futures = {
+                        region_code: pool.submit(prepare_region_file, file_path, region_code, self.use_snapshots)
+                        for region_code, (file_path, _) in pending.items()
+                    }
+                    for region_code, future in futures.items():
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.warning(f"Parallel load of {region_code} failed ({e}); loading in-process")
+                            continue
+                        columns = self._adopt_worker_result(region_code, *pending[region_code], result)
+                        if columns is not None:
+                            loaded[region_code] = columns
+                            timings[region_code] = {'seconds': result['seconds'], 'source': result['source'],
+                                                    'rows': result['rows'], 'pid': result['pid']}
+            except OSError as e:
+                logger.warning(f"Process pool unavailable ({e}); loading regions sequentially")
+            logger.info(f"Loaded {len(pending)} regions with {workers} workers in {time.perf_counter() - started:.2f}s")
+        
+        # Anything not handled by the pool (single region, pool failure) loads here
+        for region_code, (file_path, _) in pending.items():
+            if region_code in loaded:
+                continue
+            started = time.perf_counter()
+            columns = self._get_cached_columns(region_code, file_path)
+            if columns is None:
+                return None
+            loaded[region_code] = columns
+            timings[region_code] = {'seconds': time.perf_counter() - started, 'source': 'in-process',
+                                    'rows': len(columns)}
+        
+        self.last_load_timings = timings
+        return {region_code: loaded[region_code] for region_code in dict.fromkeys(region_codes)}
+    
+    def _load_regions_sqlite(self, region_codes: Sequence[str]) -> Optional[Dict[str, RegionColumns]]:
+        """load_regions for the sqlite backend: each region is read from the database."""
+        timings = {}
+        loaded = {}
+        for region_code in dict.fromkeys(region_codes):
+            started = time.perf_counter()
+            columns = self.load_region_columns(region_code)
+            if columns is None:
+                return None
+            loaded[region_code] = columns
+            timings[region_code] = {'seconds': time.perf_counter() - started, 'source': 'sqlite',
+                                    'rows': len(columns)}
+        self.last_load_timings = timings
+        return loaded
+    
+    def _adopt_worker_result(self, region_code: str, file_path: str, submitted_signature,
+                             result: Dict) -> Optional[RegionColumns]:
+        """Turn a prepare_region_file result into cached columns (None if the file changed meanwhile)."""
+        signature = self._file_signature(file_path)
+        if signature is None or signature != submitted_signature:
+            return None
+        if 'snapshot' in result:
+            columns = load_snapshot(result['snapshot'], region_code, signature[1], signature[2])
+        else:
+            columns = columns_from_payload(region_code, result['payload'])
+        if columns is None:
             return None
+        with self._cache_lock:
+            self._cache_misses += 1
+        self._cache_store(region_code, signature, columns)
+        return columns
     
-    def get_carbon_stats(self, region_code: str) -> Optional[Dict]:
-        """Get carbon intensity statistics for a region."""
-        data = self.load_region_data(region_code, max_rows=500)  # Last ~500 records
-        if not data:
+    def _ingest_workers_for(self, file_size: int) -> int:
+        """Processes to parse a file of this size with (1 = in-process)."""
+        if self.parallel_ingest_min_bytes is None or file_size < self.parallel_ingest_min_bytes:
+            return 1
+        return self.ingest_workers
+    
+    def _cache_lookup(self, region_code: str, signature) -> Optional[RegionColumns]:
+        """Cached columns for a region if still current, marking it most recently used."""
+        with self._cache_lock:
+            cached = self._data_cache.get(region_code)
+            if cached is None or cached[0] != signature:
+                return None
+            self._data_cache.move_to_end(region_code)
+            self._cache_hits += 1
+            return cached[1]
+    
+    def _ingest_appended(self, region_code: str, file_path: str, signature) -> Optional[RegionColumns]:
+        """
+        Catch a cached region up with rows appended to its file since it was loaded.
+        
+        Only the bytes after the ingested offset are parsed; the new rows are
+        appended to the cached columns and fed to the region's analytics (rolling
+        stats, profiles, rollups). Returns None - meaning a full reload is needed -
+        when the region is not cached, the file shrank, its first bytes or the
+        bytes before the offset changed (rewritten), or the new rows are not all
+        newer than the ones already loaded. Caller holds the region lock.
+        """
+        with self._cache_lock:
+            cached = self._data_cache.get(region_code)
+            state = self._ingest_state.get(region_code)
+        if cached is None or state is None:
+            return None
+        offset, head, tail = state
+        if signature[1] < offset:
+            logger.info(f"{file_path} was truncated; reloading {region_code}")
             return None
         
-        carbon_values = [row['carbon_intensity_avg'] for row in data]
+        try:
+            if file_fingerprint(file_path, offset) != (head, tail) or (tail and not tail.endswith(b'\n')):
+                logger.info(f"{file_path} was rewritten; reloading {region_code}")
+                return None
+            appended, new_offset = read_appended_columns(file_path, region_code, offset)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read appended rows of {file_path} ({e}); reloading {region_code}")
+            return None
         
-        if not carbon_values:
+        columns = cached[1]
+        if len(appended) and len(columns) and appended.timestamps[0] <= columns.timestamps[-1]:
+            logger.info(f"Rows appended to {file_path} are not newer than loaded data; reloading {region_code}")
             return None
         
-        stats = {
-            'mean': statistics.mean(carbon_values),
-            'min': min(carbon_values),
-            'max': max(carbon_values),
-            'current': carbon_values[0] if carbon_values else None,  # Most recent
-            'std': statistics.stdev(carbon_values) if len(carbon_values) > 1 else 0,
-            'trend': self._calculate_trend(carbon_values),
-            'data_points': len(carbon_values)
-        }
+        if len(appended):
+            old_rows = len(columns)
+            columns.extend_rows(appended)
+            entry = self._analytics.get(region_code)
+            if entry is not None and entry[0] is columns:
+                entry[1].extend(columns, old_rows)
+            logger.info(f"Appended {len(appended)} new records to {region_code}")
         
-        return stats
+        with self._cache_lock:
+            self._appended_rows += len(appended)
+        self._cache_store(region_code, signature, columns, offset=new_offset)
+        return columns
+    
+    def refresh_loaded_regions(self) -> Dict[str, int]:
+        """Pick up file changes for every cached region now; returns the row count per region."""
+        refreshed = {}
+        for region_code in list(self._data_cache):
+            file_path = self._region_file(region_code)
+            columns = file_path and self._get_cached_columns(region_code, file_path)
+            if columns is not None:
+                refreshed[region_code] = len(columns)
+        return refreshed
     
-    def _calculate_trend(self, values: List[float]) -> str:
-        """Calculate if carbon intensity is trending up, down, or stable."""
-        if len(values) < 10:
-            return "insufficient_data"
+    def start_watching(self, interval: float = 60.0):
+        """Poll the files of cached regions every ``interval`` seconds in a background thread."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._watch_stop.clear()
         
-        # Compare recent 10% vs previous 10%
-        n = len(values)
-        recent_window = max(5, n // 10)
+        def watch():
+            while not self._watch_stop.wait(interval):
+                try:
+                    self.refresh_loaded_regions()
+                except Exception as e:
+                    logger.error(f"Error refreshing region data: {e}")
         
-        recent_avg = statistics.mean(values[:recent_window])  # Most recent data
-        previous_avg = statistics.mean(values[recent_window:recent_window*2])
+        self._watcher = threading.Thread(target=watch, name="carbon-data-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.data_dir} for appended data every {interval}s")
+    
+    def stop_watching(self):
+        """Stop the background watcher started by start_watching."""
+        self._watch_stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+    
+    def _cache_store(self, region_code: str, signature, columns: RegionColumns, offset: Optional[int] = None):
+        """
+        Cache a region's columns, then evict cold regions until back under budget.
         
-        diff_pct = ((recent_avg - previous_avg) / previous_avg) * 100
+        ``offset`` is how far into the file the columns cover (default: the whole
+        file as of ``signature``); it is where the next append-only ingest starts.
+        """
+        if offset is None:
+            offset = signature[1]
+        state = None
+        # Compressed files are reloaded whole when they change (no byte-offset appends)
+        if not is_compressed(signature[0]):
+            try:
+                state = (offset, *file_fingerprint(signature[0], offset))
+            except OSError:
+                pass
+        with self._cache_lock:
+            if state is None:
+                self._ingest_state.pop(region_code, None)
+            else:
+                self._ingest_state[region_code] = state
+            self._data_cache[region_code] = (signature, columns)
+            self._data_cache.move_to_end(region_code)
+            self._evict_over_budget(keep=region_code)
+    
+    def _region_nbytes(self, region_code: str) -> int:
+        """
+        Memory held for a cached region: its owned column buffers plus its analytics.
         
-        if diff_pct > 5:
-            return "increasing"
-        elif diff_pct < -5:
-            return "decreasing"
-        else:
-            return "stable"
+        Columns mapped from a binary snapshot are not counted - their pages belong
+        to the OS page cache - so they do not push other regions out of the budget.
+        """
+        total = self._data_cache[region_code][1].nbytes
+        analytics = self._analytics.get(region_code)
+        if analytics is not None:
+            total += analytics[1].nbytes
+        return total
+    
+    def _evict_over_budget(self, keep: str):
+        """Drop least recently used regions (never ``keep``) while over cache_budget_bytes. Caller holds _cache_lock."""
+        total = sum(self._region_nbytes(region) for region in self._data_cache)
+        while total > self.cache_budget_bytes:
+            victim = next((region for region in self._data_cache if region != keep), None)
+            if victim is None:
+                break
+            total -= self._region_nbytes(victim)
+            del self._data_cache[victim]
+            self._analytics.pop(victim, None)
+            self._ingest_state.pop(victim, None)
+            self._cache_evictions += 1
+            logger.info(f"Evicted {victim} from the region cache (budget {self.cache_budget_bytes} bytes)")
     
-    def predict_carbon_intensity(self, region_code: str, hours_ahead: int = 24) -> Optional[Dict]:
-        """EDUCATIONAL DEMO: Shows how prediction might work using 2022 historical patterns. NOT real future predictions."""
-        data = self.load_region_data(region_code, max_rows=200)
-        if not data:
+    def get_hourly_grid(self, region_codes: List[str], start_ts: int | None = None,
+                        end_ts: int | None = None, gap_fill: str = 'ffill') -> Optional[HourlyGrid]:
+        """
+        Resample several regions onto one shared hourly grid (hours x regions matrix).
+        
+        See carbon_store.align_hourly for the gap-fill policies. Returns None if any
+        region cannot be loaded.
+        """
+        series = {}
+        for region_code in region_codes:
+            columns = self.load_region_columns(region_code)
+            if columns is None:
+                return None
+            series[region_code] = columns
+        return align_hourly(series, start_ts, end_ts, gap_fill)
+    
+    def get_cache_stats(self) -> Dict:
+        """Hit/miss counters and per-region sizes (owned and snapshot-mapped bytes) for the parsed-region cache."""
+        with self._cache_lock:
+            return {
+                'hits': self._cache_hits,
+                'misses': self._cache_misses,
+                'evictions': self._cache_evictions,
+                'appended_rows': self._appended_rows,
+                'budget_bytes': self.cache_budget_bytes,
+                'regions': {
+                    region: {'rows': len(self._data_cache[region][1]), 'bytes': self._region_nbytes(region),
+                             'mapped_bytes': self._data_cache[region][1].mapped_nbytes}
+                    for region in self._data_cache
+                }
+            }
+    
+    def clear_cache(self):
+        """Drop all parsed regions (counters are kept)."""
+        with self._cache_lock:
+            self._data_cache.clear()
+            self._analytics.clear()
+            self._ingest_state.clear()
+    
+    def get_region_analytics(self, region_code: str) -> Optional[RegionAnalytics]:
+        """
+        Rolling analytics for a region, built once per loaded version of its data.
+        
+        Rebuilt only when the cached columns are replaced (i.e. the file changed);
+        with the sqlite backend, when the region is re-imported. Rows appended
+        to the cached columns are fed in incrementally by _ingest_appended.
+        
+        With the sqlite backend the history is streamed from the database a
+        chunk at a time and never held whole. The analytics keep only day and
+        month rollups, because hourly history is read from the rollups table.
+        """
+        if self.sqlite_store is not None:
+            file_path = self._region_file(region_code)
+            signature = file_path and self._sync_sqlite(region_code, file_path)
+            if not signature:
+                return None
+            entry = self._analytics.get(region_code)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+            # Streamed in chunks; hourly rollups are served by the rollups table instead
+            analytics = RegionAnalytics.from_column_chunks(
+                self.sqlite_store.iter_chunks(region_code), self.sqlite_store.row_count(region_code),
+                rollup_buckets=SKETCH_BUCKETS)
+            with self._cache_lock:
+                self._analytics[region_code] = (signature, analytics)
+            return analytics
+        
+        columns = self.load_region_columns(region_code)
+        if columns is None:
+            return None
+        
+        entry = self._analytics.get(region_code)
+        if entry is not None and entry[0] is columns:
+            return entry[1]
+        
+        # Appends (_ingest_appended) extend the columns under the region lock, so
+        # building and registering under it too means none are missed or half-seen
+        with self._region_lock(region_code):
+            entry = self._analytics.get(region_code)
+            if entry is not None and entry[0] is columns:
+                return entry[1]
+            analytics = RegionAnalytics.from_columns(columns)
+            with self._cache_lock:
+                self._analytics[region_code] = (columns, analytics)
+                if region_code in self._data_cache:
+                    self._evict_over_budget(keep=region_code)
+        return analytics
+    
+    def load_region_data(self, region_code: str, max_rows: int | None = None) -> Optional[List[Dict]]:
+        """
+        Load region data as a list of row dicts sorted most recent first.
+        
+        Backward-compatible view over load_region_columns; it builds one dict per
+        row, so internal callers read the columns directly instead.
+        """
+        columns = self.load_region_columns(region_code, max_rows=max_rows)
+        if columns is None:
+            return None
+        return columns.to_rows()
+    
+    def get_carbon_stats(self, region_code: str, window=None) -> Optional[Dict]:
+        """
+        Get carbon intensity statistics for a region.
+        
+        ``window`` is the number of most recent hourly rows to cover (default 500),
+        or one of the named windows '24h', '7d', '30d'. Those are answered in O(1)
+        from the region's rolling analytics; other sizes scan the cached tail.
+        With the sqlite backend the window is read from the database by primary key.
+        """
+        if self.sqlite_store is not None:
+            file_path = self._region_file(region_code)
+            if file_path is None or self._sync_sqlite(region_code, file_path) is None:
+                return None
+            try:
+                size = resolve_window(window)
+            except ValueError as e:
+                logger.error(f"Invalid stats window {window!r}: {e}")
+                return None
+            return self.sqlite_store.carbon_stats(region_code, size)
+        
+        analytics = self.get_region_analytics(region_code)
+        if analytics is None:
             return None
         
         try:
-            # Calculate hourly averages for seasonal pattern
-            hourly_patterns = {}
-            for row in data:
-                hour = row['datetime'].hour
-                if hour not in hourly_patterns:
-                    hourly_patterns[hour] = []
-                hourly_patterns[hour].append(row['carbon_intensity_avg'])
-            
-            # Average for each hour
-            hourly_avg = {}
-            for hour, values in hourly_patterns.items():
-                hourly_avg[hour] = statistics.mean(values)
+            size = analytics.resolve_window(window)
+        except ValueError as e:
+            logger.error(f"Invalid stats window {window!r}: {e}")
+            return None
+        
+        if analytics.has_window(size):
+            return analytics.stats(size)
+        
+        columns = self.load_region_columns(region_code, max_rows=size, columns=(CARBON_COLUMN,))
+        if not columns:
+            return None
+        return stats_from_values(columns.carbon[::-1])  # Most recent first
+    
+    def _calculate_trend(self, values: Sequence[float]) -> str:
+        """Calculate if carbon intensity is trending up, down, or stable (values most recent first)."""
+        return window_trend(values)
+    
+    def get_history(self, region_code: str, start=None, end=None, bucket: str = 'day') -> Optional[List[Dict]]:
+        """
+        Pre-aggregated history for a region: one cell per hour/day/month bucket.
+        
+        ``start``/``end`` may be datetimes, epoch seconds, ISO strings or None. Each
+        cell has count and mean/min/max of carbon intensity and renewable share,
+        served from the rollups in the region's analytics rather than raw rows
+        (or from the rollups table with the sqlite backend).
+        """
+        if self.sqlite_store is not None:
+            file_path = self._region_file(region_code)
+            if file_path is None or self._sync_sqlite(region_code, file_path) is None:
+                return None
+            return self.sqlite_store.history(region_code, bucket, to_epoch(start), to_epoch(end))
+        
+        analytics = self.get_region_analytics(region_code)
+        if analytics is None:
+            return None
+        return analytics.history(bucket, to_epoch(start), to_epoch(end))
+    
+    def get_carbon_percentiles(self, region_codes, percentiles: Sequence[float] = (50, 90, 99),
+                               start=None, end=None) -> Optional[Dict]:
+        """
+        Approximate carbon intensity percentiles for one region or several combined.
+        
+        Answered from the KLL sketches kept in each region's analytics, merged
+        across regions (and across day/month buckets when ``start``/``end`` limit
+        the range, at whole-day granularity). Results are keyed 'p50', 'p90', ...
+        and are typically within about 1% in rank of the exact values.
+        """
+        if isinstance(region_codes, str):
+            region_codes = [region_codes]
+        start_ts, end_ts = to_epoch(start), to_epoch(end)
+        for p in percentiles:
+            if not 0 <= p <= 100:
+                raise ValueError(f"Percentile {p} outside 0-100")
+        
+        merged = None
+        for region_code in region_codes:
+            analytics = self.get_region_analytics(region_code)
+            if analytics is None:
+                logger.warning(f"No analytics for {region_code}; skipped in percentiles")
+                continue
+            sketch = analytics.distribution(start_ts, end_ts)
+            merged = sketch.copy() if merged is None else merged.merge(sketch)
+        if merged is None or not merged.n:
+            return None
+        
+        values = merged.quantiles([p / 100 for p in percentiles])
+        result = {f"p{p:g}": round(value, 1) for p, value in zip(percentiles, values)}
+        result['count'] = merged.n
+        return result
+    
+    def get_percentile_rank(self, region_code: str, value: float | None = None) -> Optional[Dict]:
+        """
+        Where ``value`` (default: the region's current intensity) falls in the region's history.
+        
+        Returns the value and its approximate percentile rank (0-100) among all
+        readings for the region.
+        """
+        analytics = self.get_region_analytics(region_code)
+        if analytics is None or not analytics.rows:
+            return None
+        if value is None:
+            value = analytics.latest
+        return {
+            'value': value,
+            'percentile_rank': round(analytics.sketch.rank(value) * 100, 1),
+            'count': analytics.sketch.n
+        }
+    
+    def predict_carbon_intensity(self, region_code: str, hours_ahead: int = 24,
+                                 profile: str = 'recent') -> Optional[Dict]:
+        """
+        EDUCATIONAL DEMO: Shows how prediction might work using 2022 historical patterns. NOT real future predictions.
+        
+        ``profile`` picks the seasonal pattern: 'recent' (hour of day over the last
+        200 records), or 'hour_of_day', 'hour_of_week', 'month_hour' over the whole
+        history. All are precomputed in the region's analytics, so this is a lookup.
+        """
+        analytics = self.get_region_analytics(region_code)
+        if analytics is None or not analytics.rows:
+            return None
+        
+        try:
+            # Recent trend from 2022 data
+            recent_trend = analytics.window_mean(24)  # Last 24 records
+            overall_avg = analytics.window_mean(analytics.pattern_window)
             
             # Generate pattern demonstration (using 2022 data to show typical patterns)
-            last_datetime = data[0]['datetime']  # Most recent from 2022
+            last_ts = analytics.last_ts  # Most recent from 2022
+            last_hour = last_ts // 3600 % 24
             predictions = []
             
-            # Recent trend from 2022 data
-            recent_values = [row['carbon_intensity_avg'] for row in data[:24]]  # Last 24 records
-            recent_trend = statistics.mean(recent_values) if recent_values else 0
-            overall_avg = statistics.mean([row['carbon_intensity_avg'] for row in data])
-            
             for i in range(1, hours_ahead + 1):
-                hour_of_day = (last_datetime.hour + i) % 24  # Cycle through hours
+                hour_of_day = (last_hour + i) % 24  # Cycle through hours
                 
-                # Base pattern on hourly average from 2022
-                seasonal_avg = hourly_avg.get(hour_of_day, overall_avg)
+                # Base pattern on the seasonal average from 2022
+                seasonal_avg = analytics.seasonal_mean(profile, last_ts + i * 3600)
+                if seasonal_avg is None:
+                    seasonal_avg = overall_avg
                 
                 # Weighted combination
                 pattern_value = (seasonal_avg * 0.7) + (recent_trend * 0.3)
@@ -188,24 +859,44 @@ class SimpleCarbonDataProcessor:
             return {
                 'region': region_code,
                 'predictions': predictions,
-                'base_stats': self.get_carbon_stats(region_code)
+                'base_stats': analytics.stats(analytics.stats_window)
             }
             
         except Exception as e:
             logger.error(f"Error predicting for {region_code}: {e}")
             return None
     
-    def generate_simple_chart_data(self, region_code: str) -> Dict:
-        """Generate data for simple HTML charts."""
-        data = self.load_region_data(region_code, max_rows=48)  # Last 48 records
-        if not data:
+    def generate_simple_chart_data(self, region_code: str, hours: int = 24,
+                                   max_points: int = CHART_MAX_POINTS) -> Dict:
+        """
+        Generate data for simple HTML charts.
+        
+        Covers the last ``hours`` records; longer ranges are downsampled with LTTB
+        (on carbon intensity, sharing the chosen points with the renewable series)
+        to at most ``max_points`` points so the payload stays bounded.
+        """
+        columns = self.load_region_columns(
+            region_code, max_rows=hours,
+            columns=(CARBON_COLUMN, 'power_production_percent_renewable_avg'))
+        if not columns:
             return {}
         
+        carbon = columns.carbon
+        renewable = columns.column('power_production_percent_renewable_avg')
+        try:
+            keep = lttb_indices(columns.timestamps, carbon, max_points)
+        except ValueError as e:
+            logger.error(f"Cannot downsample chart for {region_code}: {e}")
+            return {}
+        
+        # Show dates once the range spans more than a couple of days
+        label_format = '%H:%M' if hours <= 48 else '%m-%d %H:%M'
+        
         # Prepare chart data
         chart_data = {
-            'labels': [row['datetime'].strftime('%H:%M') for row in reversed(data[-24:])],  # Last 24 hours
-            'carbon_values': [row['carbon_intensity_avg'] for row in reversed(data[-24:])],
-            'renewable_values': [row['power_production_percent_renewable_avg'] for row in reversed(data[-24:])],
+            'labels': [epoch_to_datetime(columns.timestamps[i]).strftime(label_format) for i in keep],
+            'carbon_values': [carbon[i] for i in keep],
+            'renewable_values': [renewable[i] for i in keep],
             'region_name': self.available_regions[region_code]['name']
         }
         
@@ -361,17 +1052,24 @@ class HistoricalSimulationEngine:
     - Real HAProxy weight updates via dataplane API
     - Cumulative impact tracking (carbon/cost savings)
     - Playback controls (play/pause/speed)
+    - Headless fast-forward (run_offline) for evaluating whole periods at CPU speed
     """
     
-    def __init__(self, data_processor: SimpleCarbonDataProcessor):
+    def __init__(self, data_processor: SimpleCarbonDataProcessor, gap_fill: str = 'ffill'):
         """
         Initialize the simulation engine.
         
         Args:
             data_processor: Instance of SimpleCarbonDataProcessor for CSV data access
+            gap_fill: How hours without data are filled on the aligned grid
+                      ('ffill', 'linear' or 'missing' - see carbon_store.align_hourly)
         """
         self.data_processor = data_processor
+        self.gap_fill = gap_fill
         self.haproxy_api = HAProxyDataplaneAPI()
+        # HAProxy weight range used by calculate_carbon_weights
+        self.min_weight = MIN_WEIGHT
+        self.max_weight = MAX_WEIGHT
         
         # Simulation state
         self.is_running = False
@@ -380,6 +1078,10 @@ class HistoricalSimulationEngine:
         self.simulation_thread = None
         self.simulation_data = {}
         self.simulation_results = {}
+        # hours x servers carbon intensity matrix for the loaded period
+        self.intensity_grid = None
+        # Per-server position of the last carbon lookup (simulation time only moves forward)
+        self._lookup_cursors = {}
         
         # Server region mapping (matches production setup)
         self.server_regions = {
@@ -396,8 +1098,8 @@ class HistoricalSimulationEngine:
         
         Algorithm Logic:
         1. Convert carbon intensities to "green scores" (lower carbon = higher score)
-        2. Normalize scores to HAProxy weight range (50-256)
-        3. Ensure minimum weight of 50 to maintain basic connectivity
+        2. Normalize scores to HAProxy weight range (min_weight-max_weight, default 50-256)
+        3. Ensure minimum weight of min_weight to maintain basic connectivity
         
         This algorithm favors servers in regions with lower carbon intensity,
         routing more traffic to "greener" locations while maintaining service availability.
@@ -412,33 +1114,10 @@ class HistoricalSimulationEngine:
             logger.warning("No carbon intensity data available, using equal weights")
             return {server: 100 for server in self.server_regions.keys()}
         
-        # Step 1: Convert carbon intensities to green scores (inverse relationship)
-        green_scores = {}
-        for server, intensity in carbon_intensities.items():
-            # Invert carbon intensity: lower carbon = higher green score
-            # Use 1000 as base to avoid very small numbers
-            green_scores[server] = 1000.0 / max(intensity, 1.0)  # Avoid division by zero
-        
-        # Step 2: Normalize scores to HAProxy weight range
-        min_score = min(green_scores.values())
-        max_score = max(green_scores.values())
-        score_range = max_score - min_score
-        
-        weights = {}
-        for server, score in green_scores.items():
-            if score_range > 0:
-                # Normalize to 0-1, then scale to 50-256 range
-                # 50 = minimum weight to ensure basic connectivity
-                # 256 = maximum HAProxy weight
-                normalized = (score - min_score) / score_range
-                weight = int(50 + normalized * 206)
-            else:
-                # All scores equal = use default weight
-                weight = 100
-                
-            weights[server] = weight
-        
-        return weights
+        # Green scores normalized onto the weight range (shared with the batch kernel,
+        # so simulation_kernel.simulate_grid reproduces these weights exactly)
+        weights = carbon_weights(list(carbon_intensities.values()), self.min_weight, self.max_weight)
+        return dict(zip(carbon_intensities, weights))
     
     def load_simulation_period(self, start_date: str, end_date: str) -> bool:
         """
@@ -452,42 +1131,14 @@ class HistoricalSimulationEngine:
             True if data loaded successfully, False otherwise
         """
         try:
-            # If 'auto', we will compute min/max later
-            auto_start = start_date == 'auto'
-            auto_end = end_date == 'auto'
-            from datetime import timezone
-            start_dt = datetime.min.replace(tzinfo=timezone.utc) if auto_start else datetime.strptime(start_date, "%Y-%m-%d")
-            end_dt = datetime.max.replace(tzinfo=timezone.utc) if auto_end else datetime.strptime(end_date, "%Y-%m-%d")
-            
-            logger.info(f"Loading simulation data from {start_date} to {end_date}")
-            
-            # Load data for each region
-            simulation_data = {}
-            for server, region in self.server_regions.items():
-                region_data = self.data_processor.load_region_data(region)
-                if not region_data:
-                    logger.error(f"Failed to load data for region {region}")
-                    return False
-                
-                # Filter data by date range
-                filtered_data = []
-                for row in region_data:
-                    row_date = row['datetime']
-                    if start_dt <= row_date <= end_dt:
-                        filtered_data.append(row)
-                
-                simulation_data[server] = filtered_data
-                logger.info(f"Loaded {len(filtered_data)} records for {server} ({region})")
-            
-            self.simulation_data = simulation_data
+            period = self._prepare_period(start_date, end_date)
+            if period is None:
+                return False
+            self.simulation_data, self.intensity_grid = period
+            self._lookup_cursors = {}
             
             # Initialize results tracking
-            self.simulation_results = {
-                'timeline': [],
-                'cumulative_carbon_saved': 0,
-                'cumulative_cost_diff': 0,
-                'weight_changes': []
-            }
+            self.simulation_results = self._new_results()
             
             return True
             
@@ -495,34 +1146,158 @@ class HistoricalSimulationEngine:
             logger.error(f"Error loading simulation period: {e}")
             return False
     
+    def _new_results(self) -> Dict:
+        """Empty results tracking for a simulation run."""
+        return {
+            'timeline': [],
+            'cumulative_carbon_saved': 0,
+            'cumulative_cost_diff': 0,
+            'weight_changes': [],
+            'load_timings': dict(self.data_processor.last_load_timings)
+        }
+    
+    def _prepare_period(self, start_date: str, end_date: str) -> Optional[Tuple[Dict[str, RegionColumns],
+                                                                                   Optional[HourlyGrid]]]:
+        """
+        Load the servers' regions and align them on an hourly grid for a period.
+        
+        Returns (per-server columns within the range, hourly intensity grid or
+        None if the period is empty), or None if a region failed to load. Engine
+        state is left untouched, so offline runs can use this alongside a live one.
+        """
+        # 'auto' leaves that side of the range open; dates are interpreted as UTC
+        start_ts = None if start_date == 'auto' else date_to_epoch(start_date)
+        end_ts = None if end_date == 'auto' else date_to_epoch(end_date)
+        
+        logger.info(f"Loading simulation data from {start_date} to {end_date}")
+            
+        # Load every region up front (uncached CSVs are parsed in parallel processes)
+        loaded = self.data_processor.load_regions(list(self.server_regions.values()))
+        if loaded is None:
+            logger.error("Failed to load data for the simulation regions")
+            return None
+        for region, timing in self.data_processor.last_load_timings.items():
+            logger.info(f"Region {region}: {timing['rows']} rows from {timing['source']} in {timing['seconds']:.2f}s")
+        
+        simulation_data = {}
+        region_columns_by_server = {}
+        for server, region in self.server_regions.items():
+            region_columns = loaded[region]
+            if not region_columns:
+                logger.error(f"Failed to load data for region {region}")
+                return None
+            
+            # Filter data by date range (binary search on the sorted timestamps)
+            filtered_data = region_columns.between(start_ts, end_ts)
+            
+            simulation_data[server] = filtered_data
+            region_columns_by_server[server] = region_columns
+            logger.info(f"Loaded {len(filtered_data)} records for {server} ({region})")
+        
+        # Resample every server onto one shared hourly grid so ticks index it directly
+        if start_ts is None:
+            start_ts = min((data.timestamps[0] for data in simulation_data.values() if len(data)), default=None)
+        if end_ts is None:
+            end_ts = max((data.timestamps[-1] for data in simulation_data.values() if len(data)), default=None)
+        if start_ts is not None and end_ts is not None:
+            grid = align_hourly(region_columns_by_server, start_ts, end_ts, self.gap_fill)
+        else:
+            grid = None
+        return simulation_data, grid
+    
+    def load_period_grid(self, start_date: str, end_date: str) -> Optional[HourlyGrid]:
+        """
+        The servers' aligned hourly intensity grid for a period, for offline runs.
+        
+        An empty period gives a zero-hour grid over the servers rather than None,
+        so callers only have to handle load failures.
+        
+        Returns:
+            HourlyGrid, or None if the region data could not be loaded
+        """
+        try:
+            period = self._prepare_period(start_date, end_date)
+        except Exception as e:
+            logger.error(f"Error loading simulation period {start_date} to {end_date}: {e}")
+            return None
+        if period is None:
+            return None
+        _, grid = period
+        if grid is None:
+            grid = HourlyGrid(0, 0, list(self.server_regions), array('d'))
+        return grid
+    
     def get_carbon_at_time(self, target_time: datetime) -> Dict[str, float]:
         """
         Get carbon intensity values for all servers at a specific time.
         
+        On-grid hours are read straight from the aligned hourly grid. Other
+        times use the nearest data point per server: successive calls with
+        increasing times cost O(1) amortized, going backwards falls back to a
+        binary search.
+        
         Args:
             target_time: Target datetime for carbon intensity lookup
             
         Returns:
             Dict mapping server names to carbon intensity values
         """
-        carbon_values = {}
+        target_ts = datetime_to_epoch(target_time)
         
-        for server, data_points in self.simulation_data.items():
-            # Find closest data point to target time
-            closest_point = None
-            min_time_diff = float('inf')
-            
-            for point in data_points:
-                time_diff = abs((point['datetime'] - target_time).total_seconds())
-                if time_diff < min_time_diff:
-                    min_time_diff = time_diff
-                    closest_point = point
+        if self.intensity_grid is not None:
+            hour = self.intensity_grid.hour_index(target_ts)
+            if hour is not None:
+                return self.intensity_grid.row(hour)
+        
+        carbon_values = {}
+        for server, columns in self.simulation_data.items():
+            # Find closest data point to target time, resuming from the previous tick's position
+            closest_index = columns.nearest_index(target_ts, hint=self._lookup_cursors.get(server))
             
-            if closest_point:
-                carbon_values[server] = closest_point['carbon_intensity_avg']
+            if closest_index is not None:
+                self._lookup_cursors[server] = closest_index
+                carbon_values[server] = columns.carbon[closest_index]
         
         return carbon_values
     
+    def compute_hour(self, current_time: datetime, carbon_intensities: Dict[str, float],
+                     requests_per_hour: int = 1000) -> Dict:
+        """
+        Routing decision and carbon impact for one hour, without side effects.
+        
+        No HAProxy calls and no changes to simulation state: the caller decides
+        what to do with the result (simulate_hour pushes the weights live and
+        records it, run_offline just collects it). The only state carried from
+        hour to hour is the cumulative totals kept by _record_hour.
+        
+        Args:
+            current_time: Simulation time of this hour
+            carbon_intensities: Dict mapping server names to carbon intensity values
+            requests_per_hour: Number of requests to simulate for this hour
+            
+        Returns:
+            Dict containing simulation results for this hour
+        """
+        # Weights from carbon data, request distribution and its carbon impact
+        # compared with round-robin distribution (simulation_kernel.hour_result)
+        return hour_result(current_time, carbon_intensities, requests_per_hour, self.min_weight, self.max_weight)
+    
+    @staticmethod
+    def _record_hour(results: Dict, result: Dict):
+        """
+        Append an hour's result to a results dict and update its cumulative totals.
+        
+        The cumulative totals are the only cross-hour state of a simulation, so
+        hours computed independently (e.g. in shards) give the same results when
+        recorded here in time order.
+        """
+        results['cumulative_carbon_saved'] += result['carbon_saved_vs_rr']
+        results['timeline'].append(result)
+        results['weight_changes'].append({
+            'time': result['time'],
+            'weights': result['weights'].copy()
+        })
+    
     def simulate_hour(self, current_time: datetime, requests_per_hour: int = 1000) -> Dict:
         """
         Simulate one hour of operation with current carbon intensities.
@@ -541,59 +1316,192 @@ class HistoricalSimulationEngine:
             logger.warning(f"No carbon data available for {current_time}")
             return {}
         
-        # Calculate new weights based on carbon data
-        new_weights = self.calculate_carbon_weights(carbon_intensities)
+        result = self.compute_hour(current_time, carbon_intensities, requests_per_hour)
         
         # Update HAProxy weights via dataplane API
         weight_update_success = {}
-        for server, weight in new_weights.items():
+        for server, weight in result['weights'].items():
             success = self.haproxy_api.set_server_weight(server, weight)
             weight_update_success[server] = success
-        
-        # Simulate request distribution based on weights
-        total_weight = sum(new_weights.values())
-        request_distribution = {}
-        for server, weight in new_weights.items():
-            if total_weight > 0:
-                requests = int(requests_per_hour * weight / total_weight)
-                request_distribution[server] = requests
-        
-        # Calculate carbon impact
-        total_carbon = sum(request_distribution[server] * carbon_intensities[server] 
-                          for server in new_weights.keys())
-        
-        # Compare with round-robin distribution
-        rr_requests_per_server = requests_per_hour // len(new_weights)
-        rr_carbon = sum(rr_requests_per_server * carbon_intensities[server] 
-                       for server in new_weights.keys())
-        
-        carbon_saved = rr_carbon - total_carbon
-        
-        # Create hourly result
-        result = {
-            'time': current_time,
-            'carbon_intensities': carbon_intensities,
-            'weights': new_weights,
-            'weight_update_success': weight_update_success,
-            'request_distribution': request_distribution,
-            'total_carbon': total_carbon,
-            'carbon_saved_vs_rr': carbon_saved,
-            'requests_per_hour': requests_per_hour
-        }
+        result['weight_update_success'] = weight_update_success
         
         # Update cumulative results
-        self.simulation_results['cumulative_carbon_saved'] += carbon_saved
-        self.simulation_results['timeline'].append(result)
-        self.simulation_results['weight_changes'].append({
-            'time': current_time,
-            'weights': new_weights.copy()
-        })
+        self._record_hour(self.simulation_results, result)
         
         logger.info(f"Simulated hour {current_time.strftime('%Y-%m-%d %H:00')} - "
-                   f"Carbon saved: {carbon_saved:.2f}g CO2")
+                   f"Carbon saved: {result['carbon_saved_vs_rr']:.2f}g CO2")
         
         return result
     
+    def run_offline_batch(self, start_date: str, end_date: str, requests_per_hour: int = 1000,
+                          use_numpy: Optional[bool] = None) -> Optional[Dict]:
+        """
+        Like run_offline, but computes the whole period with the batch kernel.
+        
+        Returns per-hour columns (see simulation_kernel.simulate_grid) instead of
+        a timeline of dicts, which makes multi-year and many-server periods
+        cheap to evaluate. The numbers are the same as run_offline's.
+        
+        Returns:
+            Dict with 'kernel' (the simulate_grid columns), 'cumulative_carbon_saved',
+            'hours', 'load_timings' and 'elapsed_seconds', or None if the data
+            could not be loaded
+        """
+        started = time.perf_counter()
+        grid = self.load_period_grid(start_date, end_date)
+        if grid is None:
+            return None
+        kernel = simulate_grid(grid, requests_per_hour, self.min_weight, self.max_weight, use_numpy)
+        cumulative = kernel['cumulative_carbon_saved']
+        results = {
+            'kernel': kernel,
+            'cumulative_carbon_saved': cumulative[-1] if len(cumulative) else 0,
+            'hours': sum(kernel['simulated']),
+            'load_timings': dict(self.data_processor.last_load_timings),
+            'elapsed_seconds': time.perf_counter() - started
+        }
+        logger.info(f"Offline batch simulation {start_date} to {end_date} ({kernel['backend']}): "
+                    f"{results['hours']} hours, carbon saved {results['cumulative_carbon_saved']:.2f}g CO2 "
+                    f"in {results['elapsed_seconds']:.2f}s")
+        return results
+    
+    def run_offline_sharded(self, start_date: str, end_date: str, requests_per_hour: int = 1000,
+                            shards: Optional[int] = None, max_workers: Optional[int] = None) -> Optional[Dict]:
+        """
+        run_offline_batch for long periods, split into contiguous date shards across processes.
+        
+        The aligned grid is cut into shards of whole 24-hour blocks, each run
+        through the batch kernel by a worker (simulation_kernel.simulate_shard
+        receives just its slice of the grid and returns column bytes). Because
+        hours are independent apart from the cumulative totals, the shard
+        columns are joined in order and the totals recomputed sequentially,
+        giving exactly run_offline_batch's results. Periods shorter than
+        SHARD_MIN_HOURS per shard are not worth a process pool and run
+        in-process.
+        
+        Args:
+            start_date: Start date in "YYYY-MM-DD" format (or 'auto')
+            end_date: End date in "YYYY-MM-DD" format (or 'auto')
+            requests_per_hour: Simulated request rate
+            shards: Number of shards (default: one per worker)
+            max_workers: Worker processes (default: CPU count)
+            
+        Returns:
+            run_offline_batch's results plus 'shards' (per-shard start, hours,
+            simulated_hours), or None if the data could not be loaded
+        """
+        started = time.perf_counter()
+        grid = self.load_period_grid(start_date, end_date)
+        if grid is None:
+            return None
+        hours = len(grid)
+        width = len(grid.keys)
+        workers = max_workers or os.cpu_count() or 1
+        shards = min(shards or workers, max(hours // SHARD_MIN_HOURS, 1))
+        
+        # Shard boundaries fall on whole 24-hour blocks from the grid start
+        # (midnight for explicit dates, the first data hour for 'auto')
+        days = -(-hours // 24)
+        bounds = [min(-(-days * i // shards) * 24, hours) for i in range(shards + 1)]
+        slices = [(first, last - first) for first, last in zip(bounds, bounds[1:]) if last > first]
+        
+        def shard_args(first: int, count: int):
+            return (grid.timestamp_at(first), count, grid.keys,
+                    grid.values[first * width:(first + count) * width].tobytes(),
+                    requests_per_hour, self.min_weight, self.max_weight)
+        
+        payloads = None
+        if len(slices) > 1 and workers > 1:
+            try:
+                with process_pool(min(workers, len(slices))) as pool:
+                    futures = [pool.submit(simulate_shard, *shard_args(first, count)) for first, count in slices]
+                    payloads = [future.result() for future in futures]
+            except OSError as e:
+                logger.warning(f"Process pool unavailable ({e}); simulating shards sequentially")
+        if payloads is None:
+            slices = [(0, hours)] if hours else []
+            payloads = [simulate_shard(*shard_args(first, count)) for first, count in slices]
+        
+        # Join in time order; cumulative totals are recomputed sequentially
+        kernel = join_shards(grid.start_ts, grid.keys, payloads)
+        cumulative = kernel['cumulative_carbon_saved']
+        results = {
+            'kernel': kernel,
+            'cumulative_carbon_saved': cumulative[-1] if len(cumulative) else 0,
+            'hours': sum(kernel['simulated']),
+            'load_timings': dict(self.data_processor.last_load_timings),
+            'shards': [
+                {'start': epoch_to_datetime(grid.timestamp_at(first)).isoformat(), 'hours': count,
+                 'simulated_hours': sum(kernel['simulated'][first:first + count])}
+                for first, count in slices
+            ],
+        }
+        results['elapsed_seconds'] = time.perf_counter() - started
+        logger.info(f"Sharded offline simulation {start_date} to {end_date}: {results['hours']} hours in "
+                    f"{len(results['shards'])} shards, carbon saved {results['cumulative_carbon_saved']:.2f}g CO2 "
+                    f"in {results['elapsed_seconds']:.2f}s")
+        return results
+    
+    def compare_policies(self, start_date: str, end_date: str, requests_per_hour: int = 1000,
+                         policies: Optional[Sequence[str]] = None) -> Optional[Dict]:
+        """
+        Evaluate several weighting policies over one period, loading its data once.
+        
+        Args:
+            start_date: Start date in "YYYY-MM-DD" format (or 'auto')
+            end_date: End date in "YYYY-MM-DD" format (or 'auto')
+            requests_per_hour: Simulated request rate
+            policies: Names from simulation_policies.WEIGHT_POLICIES (default: all)
+            
+        Returns:
+            simulation_policies.compare_policies result plus 'elapsed_seconds',
+            or None if the data could not be loaded
+        """
+        started = time.perf_counter()
+        grid = self.load_period_grid(start_date, end_date)
+        if grid is None:
+            return None
+        results = compare_policies(grid, policies, requests_per_hour, self.min_weight, self.max_weight)
+        results['elapsed_seconds'] = time.perf_counter() - started
+        for name, policy_results in results['policies'].items():
+            logger.info(f"Policy {name}: carbon saved {policy_results['total_carbon_saved']:.2f}g CO2 vs round-robin")
+        return results
+    
+    def run_offline(self, start_date: str, end_date: str, requests_per_hour: int = 1000) -> Optional[Dict]:
+        """
+        Simulate a whole period as fast as possible and return the complete results.
+        
+        Same hourly computation as start_simulation, but with no sleeping between
+        hours and no HAProxy Dataplane calls. Hours are read straight off the
+        aligned intensity grid. Runs on its own copy of the period, so a live
+        simulation in progress is not disturbed.
+        
+        Args:
+            start_date: Start date in "YYYY-MM-DD" format (or 'auto')
+            end_date: End date in "YYYY-MM-DD" format (or 'auto')
+            requests_per_hour: Simulated request rate
+            
+        Returns:
+            Results dict shaped like simulation_results (timeline, cumulative
+            totals, weight_changes, load_timings) plus 'hours' and
+            'elapsed_seconds', or None if the data could not be loaded
+        """
+        started = time.perf_counter()
+        grid = self.load_period_grid(start_date, end_date)
+        if grid is None:
+            return None
+        
+        results = self._new_results()
+        for result in simulate_hours(grid, requests_per_hour, self.min_weight, self.max_weight):
+            self._record_hour(results, result)
+        
+        results['hours'] = len(results['timeline'])
+        results['elapsed_seconds'] = time.perf_counter() - started
+        logger.info(f"Offline simulation {start_date} to {end_date}: {results['hours']} hours, "
+                    f"carbon saved {results['cumulative_carbon_saved']:.2f}g CO2 "
+                    f"in {results['elapsed_seconds']:.2f}s")
+        return results
+    
     def start_simulation(self, start_date: str, end_date: str, 
                         requests_per_hour: int = 1000, speed_multiplier: float = 1.0):
         """
@@ -620,17 +1528,17 @@ class HistoricalSimulationEngine:
         def simulation_loop():
             """Main simulation loop - runs in separate thread"""
             if start_date == 'auto':
-                start_dt = min(
-                    min(points, key=lambda x: x['datetime'])['datetime'] for points in self.simulation_data.values()
-                )
+                start_dt = epoch_to_datetime(min(
+                    columns.timestamps[0] for columns in self.simulation_data.values() if len(columns)
+                ))
             else:
-                start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+                start_dt = epoch_to_datetime(date_to_epoch(start_date))
             if end_date == 'auto':
-                end_dt = max(
-                    max(points, key=lambda x: x['datetime'])['datetime'] for points in self.simulation_data.values()
-                )
+                end_dt = epoch_to_datetime(max(
+                    columns.timestamps[-1] for columns in self.simulation_data.values() if len(columns)
+                ))
             else:
-                end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+                end_dt = epoch_to_datetime(date_to_epoch(end_date))
             
             current_time = start_dt
             sleep_duration = 1.0 / speed_multiplier  # Base: 1 second per hour
@@ -696,9 +1604,22 @@ class HistoricalSimulationEngine:
 
 # Utility functions for experiment app integration
 def get_simple_processor() -> SimpleCarbonDataProcessor:
-    """Get a singleton instance of the simple data processor."""
+    """
+    Get a singleton instance of the simple data processor.
+    
+    The storage backend comes from the GREENBALANCE_BACKEND environment variable
+    ('memory' or 'sqlite', default 'memory'); GREENBALANCE_SQLITE_PATH overrides
+    where the sqlite database is kept.
+    """
     if not hasattr(get_simple_processor, '_instance'):
-        get_simple_processor._instance = SimpleCarbonDataProcessor()
+        backend = os.environ.get('GREENBALANCE_BACKEND', 'memory')
+        sqlite_path = os.environ.get('GREENBALANCE_SQLITE_PATH') or None
+        try:
+            processor = SimpleCarbonDataProcessor(backend=backend, sqlite_path=sqlite_path)
+        except ValueError as e:
+            logger.error(f"Invalid GREENBALANCE_BACKEND ({e}); using the in-memory backend")
+            processor = SimpleCarbonDataProcessor()
+        get_simple_processor._instance = processor
     return get_simple_processor._instance
 
 def get_simulation_engine() -> HistoricalSimulationEngine:
@@ -0,0 +1,181 @@
+"""
+Weighting policies for carbon-aware load balancing, compared side by side.
+
+A policy turns one hour's carbon intensities (one value per server, in grid
+column order) into HAProxy weights. compare_policies replays an aligned
+hourly intensity grid once and evaluates every registered policy on each hour,
+so several strategies can be judged against round-robin on exactly the same
+data without reloading it per experiment.
+"""
+
+from array import array
+from itertools import accumulate
+from typing import Callable, Dict, List, Optional, Sequence
+
+from carbon_store import HourlyGrid
+from simulation_kernel import EQUAL_WEIGHT, MAX_WEIGHT, MIN_WEIGHT, carbon_weights, hour_impact
+
+# Largest share of an hour's traffic the capacity_capped policy sends to one server
+CAPACITY_SHARE = 0.5
+
+# policy(intensities, previous, min_weight, max_weight) -> weights, where
+# ``previous`` is the prior hour's intensities for the same servers (None at
+# the start of the period, NaN where a server had no data)
+Policy = Callable[[Sequence[float], Optional[Sequence[float]], int, int], List[int]]
+
+
+def inverse_carbon(intensities: Sequence[float], previous: Optional[Sequence[float]],
+                   min_weight: int, max_weight: int) -> List[int]:
+    """The engine's default: 1000 / intensity scores normalized onto the weight range."""
+    return carbon_weights(intensities, min_weight, max_weight)
+
+
+def min_max(intensities: Sequence[float], previous: Optional[Sequence[float]],
+            min_weight: int, max_weight: int) -> List[int]:
+    """Intensities min-max normalized linearly: cleanest server gets max_weight, dirtiest min_weight."""
+    low = min(intensities)
+    spread = max(intensities) - low
+    if spread <= 0:
+        return [EQUAL_WEIGHT] * len(intensities)
+    span = max_weight - min_weight
+    return [int(max_weight - (intensity - low) / spread * span) for intensity in intensities]
+
+
+def threshold(intensities: Sequence[float], previous: Optional[Sequence[float]],
+              min_weight: int, max_weight: int) -> List[int]:
+    """Servers at or below the hour's mean intensity get max_weight, the rest min_weight."""
+    mean = sum(intensities) / len(intensities)
+    if max(intensities) == min(intensities):
+        return [EQUAL_WEIGHT] * len(intensities)
+    return [max_weight if intensity <= mean else min_weight for intensity in intensities]
+
+
+def forecast_aware(intensities: Sequence[float], previous: Optional[Sequence[float]],
+                   min_weight: int, max_weight: int) -> List[int]:
+    """
+    inverse_carbon on the mean of the current and the expected next-hour intensity.
+
+    The next hour is extrapolated from the last hour's change (only data up to
+    the current hour is used), so servers whose grid is getting dirtier are
+    weighted down before it shows up in the reading.
+    """
+    if previous is None:
+        return carbon_weights(intensities, min_weight, max_weight)
+    expected = []
+    for current, before in zip(intensities, previous):
+        forecast = current + (current - before) if before == before else current
+        expected.append((current + max(forecast, 1.0)) / 2)
+    return carbon_weights(expected, min_weight, max_weight)
+
+
+def capacity_capped(intensities: Sequence[float], previous: Optional[Sequence[float]],
+                    min_weight: int, max_weight: int) -> List[int]:
+    """
+    inverse_carbon, but no server gets more than CAPACITY_SHARE of the hour's traffic.
+
+    Excess share is handed to the other servers in proportion to their weights
+    (repeated until no server is over the cap); the largest share is then
+    scaled back to max_weight. Weights that would fall below min_weight are
+    raised to it, like every policy's, so a high min_weight can loosen the cap.
+    """
+    weights = carbon_weights(intensities, min_weight, max_weight)
+    cap = max(CAPACITY_SHARE, 1.0 / len(weights))
+    total = sum(weights)
+    shares = [weight / total for weight in weights]
+    capped = [False] * len(shares)
+    while True:
+        over = [i for i, share in enumerate(shares) if not capped[i] and share > cap]
+        if not over:
+            break
+        for i in over:
+            capped[i] = True
+            shares[i] = cap
+        free = [i for i in range(len(shares)) if not capped[i]]
+        free_total = sum(shares[i] for i in free)
+        if not free or free_total <= 0:
+            break
+        remaining = 1.0 - cap * sum(capped)
+        for i in free:
+            shares[i] = shares[i] / free_total * remaining
+    largest = max(shares)
+    return [max(min_weight, int(share / largest * max_weight)) for share in shares]
+
+
+# Registered policies by name (register_policy adds more)
+WEIGHT_POLICIES: Dict[str, Policy] = {
+    'inverse_carbon': inverse_carbon,
+    'min_max': min_max,
+    'threshold': threshold,
+    'forecast_aware': forecast_aware,
+    'capacity_capped': capacity_capped,
+}
+
+
+def register_policy(name: str, policy: Policy):
+    """Make a policy available to compare_policies under ``name``."""
+    WEIGHT_POLICIES[name] = policy
+
+
+def compare_policies(grid: HourlyGrid, policies: Optional[Sequence[str]] = None,
+                     requests_per_hour: int = 1000, min_weight: int = MIN_WEIGHT,
+                     max_weight: int = MAX_WEIGHT) -> Dict:
+    """
+    Evaluate several weighting policies against round-robin in one pass over ``grid``.
+
+    Hours with no data are skipped and servers missing in an hour are left out
+    of that hour, as in simulate_hour. 'inverse_carbon' reproduces the
+    engine's own results exactly.
+
+    Args:
+        grid: hours x servers carbon intensity grid (see carbon_store.align_hourly)
+        policies: Names from WEIGHT_POLICIES (default: all registered)
+        requests_per_hour: Simulated request rate
+        min_weight, max_weight: HAProxy weight range
+
+    Returns:
+        Dict with 'keys' (servers), 'timestamps' (array('q') of simulated hours),
+        'rr_carbon' (array('d') per hour) and 'policies': name -> {'total_carbon',
+        'carbon_saved', 'cumulative_carbon_saved' (array('d') per hour, aligned
+        with timestamps), 'total_carbon_saved'}
+    """
+    names = list(WEIGHT_POLICIES) if policies is None else list(policies)
+    unknown = [name for name in names if name not in WEIGHT_POLICIES]
+    if unknown:
+        raise ValueError(f"Unknown policies {unknown}; expected some of {sorted(WEIGHT_POLICIES)}")
+    evaluated = [(name, WEIGHT_POLICIES[name]) for name in names]
+
+    width = len(grid.keys)
+    values = grid.values
+    timestamps = array('q')
+    rr_column = array('d')
+    totals = {name: array('d') for name in names}
+    previous = None
+
+    for hour in range(len(grid) if width else 0):
+        row = values[hour * width:(hour + 1) * width]
+        present = [k for k, value in enumerate(row) if value == value]
+        if not present:
+            previous = None
+            continue
+        intensities = [row[k] for k in present] if len(present) < width else list(row)
+        before = [previous[k] for k in present] if previous is not None else None
+
+        for name, policy in evaluated:
+            weights = policy(intensities, before, min_weight, max_weight)
+            totals[name].append(hour_impact(intensities, weights, requests_per_hour)[1])
+        rr_requests = requests_per_hour // len(intensities)
+        rr_column.append(sum(rr_requests * intensity for intensity in intensities))
+        timestamps.append(grid.timestamp_at(hour))
+        previous = row
+
+    results = {}
+    for name in names:
+        saved = array('d', (rr - total for rr, total in zip(rr_column, totals[name])))
+        cumulative = array('d', accumulate(saved))
+        results[name] = {
+            'total_carbon': totals[name],
+            'carbon_saved': saved,
+            'cumulative_carbon_saved': cumulative,
+            'total_carbon_saved': cumulative[-1] if len(cumulative) else 0,
+        }
+    return {'keys': list(grid.keys), 'timestamps': timestamps, 'rr_carbon': rr_column, 'policies': results}
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Parameter sweeps over historical simulations.
+
+Runs the offline simulation for every combination of date range, request rate,
+weight range and weighting policy, and collects the results into one table.
+Region data is loaded once. Each period is aligned onto its own hourly grid the
+same way run_offline aligns it, so edge and gap filling never see samples from
+outside the period and every row matches run_offline for that scenario. Each
+worker process gets the period grids once, through the pool initializer.
+Scenarios that differ only in policy share a single pass (see
+simulation_policies.compare_policies).
+
+Usage:
+    python simulation_sweep.py --period 2022-01-01:2022-12-31 --period 2021-06-01:2021-08-31 \\
+        --requests 1000 5000 --weights 50:256 1:256 10:100 --policy all --output sweep.csv
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from array import array
+from itertools import product
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from carbon_store import HourlyGrid, process_pool
+from simple_data_processor import HistoricalSimulationEngine, SimpleCarbonDataProcessor
+from simulation_kernel import MAX_WEIGHT, check_weight_range, simulate_grid
+from simulation_policies import WEIGHT_POLICIES, compare_policies
+
+logger = logging.getLogger(__name__)
+
+# Columns of the comparison table, in order
+SWEEP_COLUMNS = ('start_date', 'end_date', 'policy', 'requests_per_hour', 'min_weight', 'max_weight',
+                 'hours', 'total_carbon', 'rr_carbon', 'carbon_saved', 'saved_percent')
+
+# Period grids shared by the tasks of one worker process, set by _init_worker
+_SWEEP_GRIDS: List[HourlyGrid] = []
+
+
+def _init_worker(grids: List[Tuple[int, int, List[str], bytes]]):
+    """Pool initializer: rebuild the period intensity grids once per worker."""
+    global _SWEEP_GRIDS
+    _SWEEP_GRIDS = [HourlyGrid(start_ts, hours, keys, array('d', values)) for start_ts, hours, keys, values in grids]
+
+
+def _evaluate(period: HourlyGrid, task: Dict) -> List[Dict]:
+    """Table rows for one period/rate/weight-range combination, one per policy."""
+    rph, min_weight, max_weight = task['requests_per_hour'], task['min_weight'], task['max_weight']
+    common = {'start_date': task['start_date'], 'end_date': task['end_date'], 'requests_per_hour': rph,
+              'min_weight': min_weight, 'max_weight': max_weight}
+
+    # Savings are the passes' own running totals, as run_offline reports them
+    totals, savings = {}, {}
+    if list(task['policies']) == ['inverse_carbon']:
+        # The batch kernel covers the engine's own policy without a per-hour loop
+        kernel = simulate_grid(period, rph, min_weight, max_weight)
+        simulated = kernel['simulated']
+        hours = sum(simulated)
+        rr_carbon = sum(value for value, ok in zip(kernel['rr_carbon'], simulated) if ok)
+        totals['inverse_carbon'] = sum(value for value, ok in zip(kernel['total_carbon'], simulated) if ok)
+        cumulative = kernel['cumulative_carbon_saved']
+        savings['inverse_carbon'] = cumulative[-1] if len(cumulative) else 0
+    else:
+        compared = compare_policies(period, task['policies'], rph, min_weight, max_weight)
+        hours = len(compared['timestamps'])
+        rr_carbon = sum(compared['rr_carbon'])
+        for name, results in compared['policies'].items():
+            totals[name] = sum(results['total_carbon'])
+            savings[name] = results['total_carbon_saved']
+
+    rows = []
+    for name in task['policies']:
+        saved = savings[name]
+        rows.append({**common, 'policy': name, 'hours': hours, 'total_carbon': round(totals[name], 2),
+                     'rr_carbon': round(rr_carbon, 2), 'carbon_saved': round(saved, 2),
+                     'saved_percent': round(saved / rr_carbon * 100, 3) if rr_carbon else 0.0})
+    return rows
+
+
+def _worker_evaluate(task: Dict) -> List[Dict]:
+    return _evaluate(_SWEEP_GRIDS[task['grid']], task)
+
+
+def run_sweep(engine: HistoricalSimulationEngine, periods: Sequence[Tuple[str, str]],
+              requests_per_hour: Sequence[int] = (1000,),
+              weight_ranges: Sequence[Tuple[int, int]] = ((50, MAX_WEIGHT),),
+              policies: Sequence[str] = ('inverse_carbon',),
+              max_workers: Optional[int] = None) -> Optional[List[Dict]]:
+    """
+    Simulate every combination of the given parameters and return one table row per scenario.
+
+    Args:
+        engine: Engine whose server_regions and gap_fill define the scenario
+        periods: (start_date, end_date) pairs in "YYYY-MM-DD" format (or 'auto')
+        requests_per_hour: Request rates to try
+        weight_ranges: (min_weight, max_weight) pairs to try
+        policies: Names from simulation_policies.WEIGHT_POLICIES
+        max_workers: Worker processes (default: CPU count; 1 runs in-process)
+
+    Returns:
+        Rows with the SWEEP_COLUMNS keys, in parameter order, or None if the
+        region data could not be loaded
+    """
+    unknown = [name for name in policies if name not in WEIGHT_POLICIES]
+    if unknown:
+        raise ValueError(f"Unknown policies {unknown}; expected some of {sorted(WEIGHT_POLICIES)}")
+    for min_weight, max_weight in weight_ranges:
+        check_weight_range(min_weight, max_weight)
+
+    started = time.perf_counter()
+    # One grid per distinct period (regions stay cached, so only alignment repeats)
+    period_index = {}
+    grids = []
+    for period in periods:
+        if period not in period_index:
+            grid = engine.load_period_grid(*period)
+            if grid is None:
+                return None
+            period_index[period] = len(grids)
+            grids.append(grid)
+
+    tasks = []
+    for (start_date, end_date), rph, (min_weight, max_weight) in product(periods, requests_per_hour, weight_ranges):
+        tasks.append({
+            'start_date': start_date, 'end_date': end_date, 'grid': period_index[(start_date, end_date)],
+            'requests_per_hour': rph, 'min_weight': min_weight, 'max_weight': max_weight,
+            'policies': list(policies)
+        })
+
+    results = None
+    workers = min(len(tasks), max_workers or os.cpu_count() or 1)
+    if workers > 1:
+        try:
+            initargs = ([(grid.start_ts, grid.hours, grid.keys, grid.values.tobytes()) for grid in grids],)
+            with process_pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+                results = list(pool.map(_worker_evaluate, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+        except OSError as e:
+            logger.warning(f"Process pool unavailable ({e}); running sweep sequentially")
+    if results is None:
+        results = [_evaluate(grids[task['grid']], task) for task in tasks]
+
+    rows = [row for task_rows in results for row in task_rows]
+    logger.info(f"Sweep of {len(rows)} scenarios ({len(tasks)} passes, {workers} workers) "
+                f"took {time.perf_counter() - started:.2f}s")
+    return rows
+
+
+def write_table(rows: List[Dict], output):
+    """Write sweep rows as CSV to a path or an open text file."""
+    if isinstance(output, str):
+        with open(output, 'w', newline='', encoding='utf-8') as f:
+            write_table(rows, f)
+        return
+    writer = csv.DictWriter(output, fieldnames=SWEEP_COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def _parse_period(value: str) -> Tuple[str, str]:
+    start, sep, end = value.partition(':')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected START:END, got {value!r}")
+    return start, end
+
+
+def _parse_weights(value: str) -> Tuple[int, int]:
+    low, sep, high = value.partition(':')
+    try:
+        weights = int(low), int(high)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected MIN:MAX weights, got {value!r}")
+    try:
+        check_weight_range(*weights)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default='HistoricalData', help='directory with the region CSVs')
+    parser.add_argument('--period', type=_parse_period, action='append',
+                        help="START:END dates (YYYY-MM-DD or 'auto'); repeatable")
+    parser.add_argument('--requests', type=int, nargs='+', default=[1000], help='requests per hour to try')
+    parser.add_argument('--weights', type=_parse_weights, nargs='+', default=[(50, MAX_WEIGHT)],
+                        help='MIN:MAX weight ranges to try')
+    parser.add_argument('--policy', nargs='+', default=['inverse_carbon'],
+                        help=f"policies to compare ('all' or some of {', '.join(WEIGHT_POLICIES)})")
+    parser.add_argument('--gap-fill', default='ffill', help="'ffill', 'linear' or 'missing'")
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--output', help='CSV file for the table (default: stdout)')
+    args = parser.parse_args()
+
+    policies = list(WEIGHT_POLICIES) if args.policy == ['all'] else args.policy
+    engine = HistoricalSimulationEngine(SimpleCarbonDataProcessor(args.data_dir), gap_fill=args.gap_fill)
+    try:
+        rows = run_sweep(engine, args.period or [('2022-12-25', '2022-12-31')], args.requests, args.weights,
+                         policies, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    if rows is None:
+        sys.exit("Failed to load region data")
+    write_table(rows, args.output or sys.stdout)
+
+
+if __name__ == '__main__':
+    main()